@@ -1,6 +1,9 @@
+import logging
 from django.dispatch import receiver
 from store.signals import order_created
 
+logger = logging.getLogger('core')
+
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
-    print(kwargs['order'])
\ No newline at end of file
+    logger.info('Order %s created', kwargs['order'].pk)
@@ -0,0 +1,85 @@
+import atexit
+import threading
+import time
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from .models import LikeCount, LikedItem, match_keys
+
+
+class LikeBuffer:
+    '''
+    Write-behind buffer for likes. like() and unlike() only record the latest state per (user, object), so a burst
+    of toggles collapses into one row change, and flush() writes everything pending with one bulk insert, one delete
+    and one counter upsert. Flushes happen once max_size changes are pending or the oldest is max_age seconds old.
+    '''
+    def __init__(self, max_size=500, max_age=5.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.started = None
+
+    def like(self, user, obj):
+        self.add(user.pk, obj, True)
+
+    def unlike(self, user, obj):
+        self.add(user.pk, obj, False)
+
+    def add(self, user_id, obj, liked):
+        content_type = ContentType.objects.get_for_model(obj)
+        with self.lock:
+            if not self.pending:
+                self.started = time.monotonic()
+            self.pending[user_id, content_type.pk, obj.pk] = liked
+        self.flush_if_due()
+
+    def pending_for(self, user_id, content_type_id):
+        with self.lock:
+            return {object_id: liked for (pending_user_id, pending_content_type_id, object_id), liked in self.pending.items()
+                    if pending_user_id == user_id and pending_content_type_id == content_type_id}
+
+    def is_due(self):
+        with self.lock:
+            return bool(len(self.pending) >= self.max_size or
+                        (self.pending and time.monotonic() - self.started >= self.max_age))
+
+    def flush_if_due(self):
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            started = self.started
+        if not pending:
+            return 0
+
+        likes = [key for key, liked in pending.items() if liked]
+        unlikes = [key for key, liked in pending.items() if not liked]
+        try:
+            with transaction.atomic():
+                LikedItem.objects.bulk_create(
+                    [LikedItem(user_id=user_id, content_type_id=content_type_id, object_id=object_id)
+                     for user_id, content_type_id, object_id in likes],
+                    ignore_conflicts=True
+                )
+                for start in range(0, len(unlikes), self.max_size):
+                    LikedItem.objects.filter(
+                        match_keys(['user_id', 'content_type_id', 'object_id'], unlikes[start:start + self.max_size])
+                    ).delete()
+                LikeCount.objects.refresh((content_type_id, object_id) for _, content_type_id, object_id in pending)
+        except Exception:
+            # back for the next flush, behind whatever was toggled while this one ran
+            with self.lock:
+                self.pending = pending | self.pending
+                self.started = started
+            raise
+        return len(pending)
+
+
+buffer = LikeBuffer(
+    max_size=getattr(settings, 'LIKES_BUFFER_SIZE', 500),
+    max_age=getattr(settings, 'LIKES_BUFFER_SECONDS', 5.0),
+)
+atexit.register(buffer.flush)
@@ -0,0 +1,43 @@
+import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import DatabaseError
+from .buffer import buffer
+
+
+logger = logging.getLogger('likes')
+
+
+class LikeBufferMiddleware:
+    '''
+    Writes the buffered likes once they are due at the end of a request, so they reach the database within
+    LIKES_BUFFER_SECONDS even when no new like comes in to trigger the flush. It runs while the request still
+    holds its database connection, request_finished receivers run after Django has closed it.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if buffer.is_due():
+            self.flush()
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if buffer.is_due():
+            await sync_to_async(self.flush)()
+        return response
+
+    def flush(self):
+        # the likes stay buffered for the next try, this request's response doesn't depend on them
+        try:
+            buffer.flush()
+        except DatabaseError:
+            logger.exception('Flushing buffered likes failed')
@@ -1,11 +1,99 @@
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import Count, Q
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from functools import reduce
+from operator import or_
+
+
+def match_keys(fields, keys):
+    # tuples of field values as one OR filter, e.g. match_keys(['content_type_id', 'object_id'], [(1, 5), (1, 7)])
+    return reduce(or_, (Q(**dict(zip(fields, key))) for key in keys))
+
+
+class LikedItemManager(models.Manager):
+    def liked_by(self, user, obj_type, obj_ids):
+        '''
+        The ids among obj_ids that the user has liked, in one query. Likes still waiting in the write-behind buffer count.
+        '''
+        from .buffer import buffer
+
+        if not user.is_authenticated:
+            return set()
+        content_type = ContentType.objects.get_for_model(obj_type)
+        obj_ids = set(obj_ids)
+        liked = set(LikedItem.objects
+                    .filter(user=user, content_type=content_type, object_id__in=obj_ids)
+                    .values_list('object_id', flat=True))
+        for object_id, is_liked in buffer.pending_for(user.pk, content_type.pk).items():
+            if object_id in obj_ids:
+                (liked.add if is_liked else liked.discard)(object_id)
+        return liked
 
 
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'])
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='likes_likeditem_unique_like')
+        ]
+
+
+class LikeCountManager(models.Manager):
+    def counts_for(self, obj_type, obj_ids):
+        '''
+        Like counts of many objects of one type in one query, as {object_id: count}.
+        '''
+        content_type = ContentType.objects.get_for_model(obj_type)
+        counts = LikeCount.objects \
+            .filter(content_type=content_type, object_id__in=obj_ids) \
+            .values_list('object_id', 'count')
+        return {object_id: 0 for object_id in obj_ids} | dict(counts)
+
+    def refresh(self, keys):
+        '''
+        Recounts the likes of the given (content_type_id, object_id) pairs and upserts their LikeCount rows.
+        '''
+        keys = set(keys)
+        if not keys:
+            return
+        counts = dict.fromkeys(keys, 0)
+        rows = LikedItem.objects \
+            .filter(match_keys(['content_type_id', 'object_id'], keys)) \
+            .values('content_type_id', 'object_id') \
+            .annotate(count=Count('id'))
+        for row in rows:
+            counts[row['content_type_id'], row['object_id']] = row['count']
+
+        connection = connections[router.db_for_write(LikeCount)]
+        unique_fields = ['content_type', 'object_id'] \
+            if connection.features.supports_update_conflicts_with_target else None
+        LikeCount.objects.bulk_create(
+            [LikeCount(content_type_id=content_type_id, object_id=object_id, count=count)
+             for (content_type_id, object_id), count in counts.items()],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['count']
+        )
+
+
+class LikeCount(models.Model):
+    # materialized number of likes per object, kept current by likes.buffer
+    objects = LikeCountManager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='likes_likecount_unique_object')
+        ]
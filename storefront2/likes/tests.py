@@ -1,3 +1,87 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import DatabaseError
 from django.test import TestCase
+from .buffer import LikeBuffer, buffer
+from .models import LikeCount, LikedItem
 
-# Create your tests here.
+
+class LikeBufferTest(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create_user(username=f'user{index}', email=f'user{index}@example.com')
+                      for index in range(2)]
+        # anything can be liked, users will do
+        self.liked = [User.objects.create_user(username=f'liked{index}', email=f'liked{index}@example.com')
+                      for index in range(2)]
+        self.content_type = ContentType.objects.get_for_model(get_user_model())
+        self.buffer = LikeBuffer(max_size=100, max_age=60)
+
+    def count(self, obj):
+        return LikeCount.objects.counts_for(type(obj), [obj.pk])[obj.pk]
+
+    def test_toggles_collapse_into_the_latest_state(self):
+        first, second = self.liked
+        self.buffer.like(self.users[0], first)
+        self.buffer.unlike(self.users[0], first)
+        self.buffer.like(self.users[0], first)
+        self.buffer.like(self.users[0], second)
+        self.buffer.unlike(self.users[0], second)
+        self.assertEqual(self.buffer.pending_for(self.users[0].pk, self.content_type.pk),
+                         {first.pk: True, second.pk: False})
+        self.assertEqual(self.buffer.pending_for(self.users[1].pk, self.content_type.pk), {})
+        self.assertFalse(LikedItem.objects.exists())
+
+        with self.assertNumQueries(6):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(list(LikedItem.objects.values_list('object_id', flat=True)), [first.pk])
+        self.assertEqual(self.buffer.pending_for(self.users[0].pk, self.content_type.pk), {})
+
+    def test_like_counts_are_refreshed(self):
+        liked = self.liked[0]
+        for user in self.users:
+            self.buffer.like(user, liked)
+        self.buffer.flush()
+        self.assertEqual(self.count(liked), 2)
+
+        self.buffer.unlike(self.users[0], liked)
+        self.buffer.flush()
+        self.assertEqual(self.count(liked), 1)
+        self.assertEqual(self.count(self.liked[1]), 0)
+
+    def test_flushes_when_due(self):
+        self.buffer.max_size = 2
+        self.buffer.like(self.users[0], self.liked[0])
+        self.assertFalse(LikedItem.objects.exists())
+        self.buffer.like(self.users[1], self.liked[0])
+        self.assertEqual(LikedItem.objects.count(), 2)
+
+        self.buffer.max_size, self.buffer.max_age = 100, 0
+        self.buffer.like(self.users[0], self.liked[1])
+        self.assertEqual(LikedItem.objects.count(), 3)
+
+    def test_a_failed_flush_keeps_the_likes(self):
+        first, second = self.liked
+        self.buffer.like(self.users[0], first)
+        self.buffer.like(self.users[0], second)
+
+        def fail(*args, **kwargs):
+            # toggled while the flush runs, the newer state has to survive
+            self.buffer.unlike(self.users[0], second)
+            raise DatabaseError('gone')
+
+        with patch.object(LikedItem.objects, 'bulk_create', fail), self.assertRaises(DatabaseError):
+            self.buffer.flush()
+        self.assertEqual(self.buffer.pending_for(self.users[0].pk, self.content_type.pk),
+                         {first.pk: True, second.pk: False})
+        self.buffer.flush()
+        self.assertEqual(list(LikedItem.objects.values_list('object_id', flat=True)), [first.pk])
+
+    def test_due_likes_are_flushed_at_the_end_of_a_request(self):
+        with patch.object(buffer, 'pending', {}), patch.object(buffer, 'max_age', 60):
+            buffer.like(self.users[0], self.liked[0])
+            self.assertFalse(LikedItem.objects.exists())
+            buffer.max_age = 0
+            self.client.get('/store/collections/')
+            self.assertEqual(LikedItem.objects.count(), 1)
@@ -4,6 +4,7 @@ from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from . import models
+from .cache import invalidate
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -47,6 +48,8 @@ class ProductAdmin(admin.ModelAdmin):
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
         updated_count = queryset.update(inventory=0)
+        # update() skips the signals that drop cached pages
+        invalidate('products')
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
@@ -70,11 +73,6 @@ class CollectionAdmin(admin.ModelAdmin):
             }))
         return format_html('<a href="{}">{} Products</a>', url, collection.products_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
-
 
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -0,0 +1,393 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+from itertools import cycle
+from types import ModuleType, SimpleNamespace
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import include, path
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from . import seeding
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Review
+from .queries import QueryRecorder
+from .renderers import FastJSONRenderer
+from .serializers import CartSerializer, CollectionSerializer, CreateOrderSerializer, OrderSerializer, ProductSerializer
+from .urls import get_urlpatterns
+from .values import CartValues, CollectionValues, OrderValues, ProductValues, ValuesSerializer
+from .views import CartViewSet, OrderViewSet
+
+
+# Benchmark scenarios for ./manage.py benchmark.
+# A scenario takes a size, seeds whatever it needs and returns the callable to time. Each repetition runs inside
+# a transaction that is rolled back, so benchmarks leave the database as they found it.
+
+
+class Rollback(Exception):
+    pass
+
+
+def measure(scenario, size, repeat):
+    timings, queries = [], 0
+    for _ in range(repeat):
+        try:
+            with transaction.atomic():
+                run = scenario(size)
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    run()
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries = len(captured)
+                raise Rollback
+        except Rollback:
+            pass
+    return {
+        'size': size,
+        'queries': queries,
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'max_ms': max(timings),
+        'per_row_us': statistics.median(timings) * 1000 / size,
+    }
+
+
+def seed_products(count):
+    collection = Collection.objects.create(title=f'benchmark {uuid4().hex[:8]}')
+    Product.objects.bulk_create([
+        Product(title=f'Product {i}', slug=f'product-{i}', unit_price=10 + i % 90,
+                inventory=1000, collection=collection)
+        for i in range(count)
+    ])
+    # MySQL doesn't hand back the ids from bulk_create
+    return list(Product.objects.filter(collection=collection).values_list('id', flat=True))
+
+
+def checkout(size):
+    # CreateOrderSerializer validating and placing an order for a cart of `size` products
+    name = uuid4().hex
+    user = get_user_model().objects.create_user(username=name, email=f'{name}@example.com')
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_id=product_id, quantity=1)
+                                  for product_id in seed_products(size)])
+
+    def run():
+        serializer = CreateOrderSerializer(data={'cart_id': cart.id}, context={'user_id': user.id})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+    return run
+
+
+def seed_collections(size):
+    prefix = f'benchmark {uuid4().hex[:8]}'
+    Collection.objects.bulk_create([Collection(title=f'{prefix} {i}') for i in range(size)])
+    return Collection.objects.filter(title__startswith=prefix)
+
+
+def seed_carts(size):
+    # `size` carts of three products each, loaded the way CartViewSet loads them
+    product_ids = seed_products(3)
+    carts = Cart.objects.bulk_create([Cart() for _ in range(size)])
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_id=product_id, quantity=2)
+                                  for cart in carts for product_id in product_ids])
+    return CartViewSet.queryset.filter(pk__in=[cart.pk for cart in carts])
+
+
+def seed_orders(size):
+    # `size` orders of three products each, loaded the way OrderViewSet loads them for staff
+    name = uuid4().hex
+    user = get_user_model().objects.create_user(username=name, email=f'{name}@example.com', is_staff=True)
+    customer = Customer.objects.get(user=user)
+    product_ids = seed_products(3)
+    Order.objects.bulk_create([Order(customer=customer) for _ in range(size)])
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=order_id, product_id=product_id, quantity=1, unit_price=10)
+        for order_id in Order.objects.filter(customer=customer).values_list('id', flat=True)
+        for product_id in product_ids
+    ])
+    return OrderViewSet(request=SimpleNamespace(user=user)).get_queryset().filter(customer=customer)
+
+
+def serialize(seed, serializer_class):
+    # serializing `size` rows with a ModelSerializer or its store.values twin, including the queries
+    def scenario(size):
+        queryset = seed(size)
+        if not issubclass(serializer_class, ValuesSerializer):
+            return lambda: serializer_class(queryset, many=True).data
+
+        def run():
+            serializer = serializer_class()
+            serializer.serialize(serializer.values(queryset))
+        return run
+    return scenario
+
+
+def product_rows(size):
+    return Product.objects.filter(pk__in=seed_products(size))
+
+
+def render(renderer_class):
+    # rendering a page of `size` serialized products to JSON bytes
+    def scenario(size):
+        serializer = ProductValues()
+        data = serializer.serialize(serializer.values(product_rows(size)))
+        return lambda: renderer_class().render(data)
+    return scenario
+
+
+SCENARIOS = {
+    'checkout': checkout,
+    'serialize-products': serialize(product_rows, ProductSerializer),
+    'serialize-products-values': serialize(product_rows, ProductValues),
+    'serialize-collections': serialize(seed_collections, CollectionSerializer),
+    'serialize-collections-values': serialize(seed_collections, CollectionValues),
+    'serialize-carts': serialize(seed_carts, CartSerializer),
+    'serialize-carts-values': serialize(seed_carts, CartValues),
+    'serialize-orders': serialize(seed_orders, OrderSerializer),
+    'serialize-orders-values': serialize(seed_orders, OrderValues),
+    'render-products': render(FastJSONRenderer),
+    'render-products-stdlib': render(JSONRenderer),
+}
+
+
+# Load tests for ./manage.py load_test. Requests go through Django's ASGI handler in process, many in flight at once,
+# against the sync or the async catalogue viewsets. Unlike the scenarios above the rows they read are committed,
+# seed_catalogue() returns a cleanup for them.
+
+
+def seed_catalogue(products):
+    product_ids = seed_products(products)
+    Review.objects.bulk_create([Review(product_id=product_ids[0], name=f'Reviewer {i}', description='Fine')
+                                for i in range(10)])
+
+    def cleanup():
+        collection_id = Product.objects.get(pk=product_ids[0]).collection_id
+        Product.objects.filter(pk__in=product_ids).delete()
+        Collection.objects.filter(pk=collection_id).delete()
+    return product_ids, cleanup
+
+
+async def asgi_get(application, url):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    body = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    status = None
+
+    async def receive():
+        if body:
+            return body.pop()
+        # the client never disconnects
+        await asyncio.get_running_loop().create_future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def drive(application, urls, concurrency, requests):
+    # `concurrency` clients sending `requests` requests between them, each waiting for its last answer
+    urls = cycle(urls)
+    latencies, errors = [], 0
+    remaining = requests
+
+    async def client():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status = await asgi_get(application, next(urls))
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def load(urls, concurrency, requests, async_views, cache=False):
+    urlconf = ModuleType('store.benchmarks.urls')
+    urlconf.urlpatterns = [path('store/', include(get_urlpatterns(async_views)))]
+    overrides = {
+        'ROOT_URLCONF': urlconf,
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'localhost'],
+        # the sync only debug toolbar would put both kinds of views on a thread
+        'MIDDLEWARE': [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar.')],
+    }
+    if not cache:
+        # time the views rather than the response cache
+        overrides['CACHES'] = {alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+                               for alias in settings.CACHES}
+
+    with override_settings(**overrides):
+        application = ASGIHandler()
+        asyncio.run(drive(application, urls, 1, len(urls)))
+        latencies, errors, duration = asyncio.run(drive(application, urls, concurrency, requests))
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'rps': requests / duration,
+        'p50_ms': percentiles[49],
+        'p99_ms': percentiles[98],
+    }
+
+
+# API benchmarks for ./manage.py benchmark_api. seed_dataset() fills an empty database with a synthetic store, then
+# each scenario sends its requests through the test client and the real URLconf. The results can be saved as a
+# baseline that later runs are compared against.
+
+
+class ScenarioFailed(Exception):
+    pass
+
+
+def seed_dataset(scale, seed=0):
+    '''
+    A store of `scale` products, scale // 10 customers and everything around them from store.seeding, in stock
+    so placing orders never runs out.
+    '''
+    plan = seeding.Plan(seed=seed, products=scale, customers=max(scale // 10, 2))
+    seeding.seed(plan)
+    Product.objects.filter(pk__in=plan.ids('product')).update(inventory=1_000_000)
+    # the customer with the most orders
+    shopper = Order.objects.filter(pk__in=plan.ids('order')).values('customer_id').annotate(orders=Count('id')) \
+                           .order_by('-orders', 'customer_id')[0]
+    return SimpleNamespace(
+        product_ids=list(plan.ids('product')), collection_ids=list(plan.ids('collection')),
+        cart_ids=list(Cart.objects.order_by('id').values_list('id', flat=True)),
+        shopper=get_user_model().objects.get(customer__id=shopper['customer_id']),
+        staff=get_user_model().objects.create_user(username='staff', email='staff@example.com', is_staff=True),
+    )
+
+
+def get(path, user=None):
+    # a GET of path, or of path(dataset, i) for the i-th request
+    return lambda dataset, i: (user, 'get', path(dataset, i) if callable(path) else path, None)
+
+
+def place_order(dataset, i):
+    # a new cart for every order, its setup isn't timed
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_id=dataset.product_ids[(i * 7 + offset) % len(
+        dataset.product_ids)], quantity=1) for offset in range(3)])
+    return 'shopper', 'post', '/store/orders/', {'cart_id': str(cart.id)}
+
+
+API_SCENARIOS = {
+    'products-list': get('/store/products/'),
+    'products-ordered': get('/store/products/?ordering=-unit_price'),
+    'products-filtered': get(lambda dataset, i: f'/store/products/?collection_id='
+                                                f'{dataset.collection_ids[i % len(dataset.collection_ids)]}'
+                                                f'&unit_price__gt=20&unit_price__lt=120'),
+    'products-search': get(lambda dataset, i: f'/store/products/?search={seeding.NOUNS[i % len(seeding.NOUNS)]}'),
+    'product-detail': get(lambda dataset, i: f'/store/products/{dataset.product_ids[i % len(dataset.product_ids)]}/'),
+    'product-reviews': get(lambda dataset, i: f'/store/products/'
+                                              f'{dataset.product_ids[i % len(dataset.product_ids)]}/reviews/'),
+    'collections-list': get('/store/collections/'),
+    'cart-detail': get(lambda dataset, i: f'/store/carts/{dataset.cart_ids[i % len(dataset.cart_ids)]}/'),
+    'orders-list': get('/store/orders/', user='shopper'),
+    'orders-list-staff': get('/store/orders/', user='staff'),
+    'order-create': place_order,
+}
+
+
+def run_scenario(dataset, scenario, repeat, warmup=3):
+    '''
+    Latency percentiles and the most queries of `repeat` requests, and the median peak of Python memory allocated
+    while answering one. Memory is traced in extra requests, tracing would slow down the timed ones.
+    '''
+    clients = {None: APIClient()}
+    for user in ('shopper', 'staff'):
+        clients[user] = APIClient()
+        clients[user].force_authenticate(getattr(dataset, user))
+
+    def send(i):
+        user, method, path, data = scenario(dataset, i)
+        client = clients[user]
+        with QueryRecorder() as recorder:
+            start = time.perf_counter()
+            response = client.get(path) if method == 'get' else getattr(client, method)(path, data, format='json')
+            duration = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise ScenarioFailed(f'{method.upper()} {path} answered {response.status_code}: {response.content[:200]}')
+        return duration, recorder.count
+
+    for i in range(warmup):
+        send(i)
+    latencies, queries = [], 0
+    for i in range(repeat):
+        duration, count = send(i)
+        latencies.append(duration * 1000)
+        queries = max(queries, count)
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(min(repeat, 5)):
+            tracemalloc.reset_peak()
+            send(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+    finally:
+        tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': repeat,
+        'p50_ms': percentiles[49],
+        'p90_ms': percentiles[89],
+        'p99_ms': percentiles[98],
+        'max_ms': max(latencies),
+        'queries': queries,
+        'peak_kb': statistics.median(peaks),
+    }
+
+
+def run_api(dataset, names, repeat, cache=False):
+    overrides = {
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        'MIDDLEWARE': [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar.')],
+        # seed_dataset() only fills the primary
+        'STORE_READ_REPLICAS': [],
+    }
+    if not cache:
+        overrides['CACHES'] = {alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+                               for alias in settings.CACHES}
+    with override_settings(**overrides):
+        return {name: run_scenario(dataset, API_SCENARIOS[name], repeat) for name in names}
+
+
+# compared against the baseline, more queries than the baseline are always a regression
+COMPARED = ['p50_ms', 'p99_ms', 'queries', 'peak_kb']
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+    (scenario, metric, baseline, current, change, regressed) for the COMPARED metrics of every scenario in both.
+    Latency and memory regress when they grow by more than `tolerance`, a fraction of the baseline.
+    '''
+    rows = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in COMPARED:
+            old, new = baseline[name][metric], result[metric]
+            change = (new - old) / old if old else 0.0
+            regressed = new > old if metric == 'queries' else change > tolerance
+            rows.append((name, metric, old, new, change, regressed))
+    return rows
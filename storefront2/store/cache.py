@@ -0,0 +1,130 @@
+import time
+from hashlib import md5
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from .renderers import FastJSONRenderer
+from .routers import read_from_replica
+
+
+# Read-through cache for the catalogue endpoints.
+# Every scope ('products', 'collections') has a generation token and cache keys embed the current token, so bumping it
+# from a save/delete signal drops every cached page of that scope at once without needing delete-by-pattern,
+# which the local memory and file backends don't have. Writes that skip the signals (queryset.update(), another
+# process's local memory cache) leave pages stale until they time out; ETags are hashed from the page itself, so a
+# client revalidating after that gets the new page rather than a 304.
+
+
+def get_cache():
+    return caches[getattr(settings, 'STORE_CACHE_ALIAS', 'default')]
+
+
+def new_generation():
+    # when it was made, then random so an evicted generation can never bring back old pages
+    return f'{time.time():.3f}:{uuid4().hex}'
+
+
+def get_generation(scope):
+    key = f'store:generation:{scope}'
+    generation = get_cache().get(key)
+    if generation is None:
+        generation = new_generation()
+        get_cache().add(key, generation, None)
+        generation = get_cache().get(key, generation)
+    return generation
+
+
+async def aget_generation(scope):
+    key = f'store:generation:{scope}'
+    generation = await get_cache().aget(key)
+    if generation is None:
+        generation = new_generation()
+        await get_cache().aadd(key, generation, None)
+        generation = await get_cache().aget(key, generation)
+    return generation
+
+
+def may_lag(generation):
+    # a page read from a replica soon after its scope changed may not show the change yet
+    if not read_from_replica():
+        return False
+    made_at = float(generation.split(':')[0]) if ':' in generation else 0
+    return time.time() - made_at < getattr(settings, 'STORE_REPLICA_MAX_LAG', 5)
+
+
+def invalidate(*scopes):
+    def bump():
+        get_cache().set_many({f'store:generation:{scope}': new_generation() for scope in scopes}, None)
+    # wait for the commit so a concurrent read can't cache the rows we are about to replace
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    '''
+    Caches list and retrieve responses per full request url and answers If-None-Match with 304 Not Modified.
+    '''
+    cache_scope = None
+    cache_timeout = getattr(settings, 'STORE_CACHE_TIMEOUT', 300)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request, generation):
+        url = request.build_absolute_uri()
+        return 'store:page:' + md5(f'{self.cache_scope}:{generation}:{url}'.encode()).hexdigest()
+
+    def get_etag(self, data):
+        return quote_etag(md5(FastJSONRenderer().render(data)).hexdigest())
+
+    def respond(self, request, data, etag):
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
+
+    def cached_response(self, view, request, *args, **kwargs):
+        generation = get_generation(self.cache_scope)
+        key = self.get_cache_key(request, generation)
+
+        page = get_cache().get(key)
+        if page is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            page = (response.data, self.get_etag(response.data))
+            if not may_lag(generation):
+                get_cache().set(key, page, self.cache_timeout)
+
+        return self.respond(request, *page)
+
+
+class AsyncCachedResponseMixin(CachedResponseMixin):
+    '''
+    CachedResponseMixin for coroutine list and retrieve actions, see store.viewsets.AsyncViewSetMixin.
+    '''
+    async def list(self, request, *args, **kwargs):
+        return await self.acached_response(super().list, request, *args, **kwargs)
+
+    async def retrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().retrieve, request, *args, **kwargs)
+
+    async def acached_response(self, view, request, *args, **kwargs):
+        generation = await aget_generation(self.cache_scope)
+        key = self.get_cache_key(request, generation)
+
+        page = await get_cache().aget(key)
+        if page is None:
+            response = await view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            page = (response.data, self.get_etag(response.data))
+            if not may_lag(generation):
+                await get_cache().aset(key, page, self.cache_timeout)
+
+        return self.respond(request, *page)
@@ -0,0 +1,11 @@
+from django.db.backends.mysql import base
+from ..pooled import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def check_connection(self, connection):
+        try:
+            connection.ping()
+        except self.Database.Error:
+            return False
+        return True
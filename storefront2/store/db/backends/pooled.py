@@ -0,0 +1,49 @@
+from ..pool import PoolTimeout, get_pool
+
+
+class PooledDatabaseWrapperMixin:
+    '''
+    Takes the DB-API connection from a pool shared by every thread of the process instead of opening one, and gives
+    it back when Django closes the connection. Configured with a POOL entry in the database settings:
+
+        'POOL': {'SIZE': 5, 'MAX_OVERFLOW': 10, 'TIMEOUT': 30, 'RECYCLE': None}
+
+    Keep CONN_MAX_AGE at 0 so connections go back to the pool at the end of every request. With CONN_HEALTH_CHECKS
+    on, idle connections are checked with check_connection() before they are reused.
+    '''
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        connect = lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params)
+        check = self.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None
+        try:
+            return self.pool.acquire(connect, check)
+        except PoolTimeout as error:
+            # surfaces as django.db.OperationalError
+            raise self.Database.OperationalError(str(error)) from error
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # a connection left in a transaction, with autocommit changed or after an error isn't fit for the next user
+        reusable = (self.autocommit == self.settings_dict['AUTOCOMMIT']
+                    and not self.in_atomic_block and not self.errors_occurred)
+        with self.wrap_database_errors:
+            self.pool.release(self.connection, reusable)
+
+    def check_connection(self, connection):
+        '''
+        Whether an idle DB-API connection still works, with a SELECT 1 any backend understands. Backends that have a
+        cheaper ping override it.
+        '''
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except self.Database.Error:
+            return False
+        return True
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import Counter
+
+
+# Process wide pools of DB-API connections for the engines in store.db.backends, one per database.
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Keeps up to `size` idle connections for reuse. While they are all in use up to `max_overflow` more can be opened,
+    those are closed when they come back. When every connection is taken acquire() waits up to `timeout` seconds for
+    one and then raises PoolTimeout. Connections older than `recycle` seconds are closed instead of reused.
+    '''
+    def __init__(self, size=5, max_overflow=10, timeout=30, recycle=None):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.condition = threading.Condition()
+        self.idle = []
+        self.opened_at = {}
+        self.open = 0
+        self.counters = Counter()
+        self.wait_total = self.wait_max = 0.0
+
+    def acquire(self, connect, check=None):
+        '''
+        The most recently returned idle connection, or a new one from connect() while there is room.
+        Idle connections that fail check(connection) are closed and skipped.
+        '''
+        start = time.perf_counter()
+        while True:
+            connection = self.checkout(start + self.timeout)
+            if connection is None:
+                break
+            if self.is_fresh(connection) and (check is None or check(connection)):
+                self.record('reused', time.perf_counter() - start)
+                return connection
+            self.discard(connection)
+
+        self.record('opened', time.perf_counter() - start)
+        try:
+            connection = connect()
+        except BaseException:
+            self.discard(None)
+            raise
+        with self.condition:
+            self.opened_at[id(connection)] = time.monotonic()
+        return connection
+
+    def checkout(self, deadline):
+        # an idle connection, or None once there is room for a new one
+        with self.condition:
+            if not self.idle and self.open >= self.size + self.max_overflow:
+                self.counters['waits'] += 1
+            while not self.idle and self.open >= self.size + self.max_overflow:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection free within {self.timeout}s, all {self.open} are in use')
+                self.condition.wait(remaining)
+            if self.idle:
+                return self.idle.pop()
+            self.open += 1
+            return None
+
+    def release(self, connection, reusable=True):
+        with self.condition:
+            if reusable and len(self.idle) < self.size and self.is_fresh(connection):
+                self.idle.append(connection)
+                self.condition.notify()
+                return
+        self.discard(connection)
+
+    def discard(self, connection):
+        with self.condition:
+            self.open -= 1
+            if connection is not None:
+                self.opened_at.pop(id(connection), None)
+                self.counters['discarded'] += 1
+            self.condition.notify()
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def is_fresh(self, connection):
+        return self.recycle is None or time.monotonic() - self.opened_at.get(id(connection), 0) < self.recycle
+
+    def record(self, outcome, wait):
+        with self.condition:
+            self.counters[outcome] += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            self.discard(connection)
+
+    def stats(self):
+        '''
+        Pool occupancy, how connections were handed out and how long acquire() took to find one,
+        not counting the time to open a new connection.
+        '''
+        with self.condition:
+            acquired = self.counters['reused'] + self.counters['opened']
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self.open,
+                'idle': len(self.idle),
+                'in_use': self.open - len(self.idle),
+                'acquired': acquired,
+                'reused': self.counters['reused'],
+                'opened': self.counters['opened'],
+                'discarded': self.counters['discarded'],
+                'waits': self.counters['waits'],
+                'timeouts': self.counters['timeouts'],
+                'wait_ms_total': self.wait_total * 1000,
+                'wait_ms_mean': self.wait_total * 1000 / acquired if acquired else 0.0,
+                'wait_ms_max': self.wait_max * 1000,
+            }
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    # keyed by the database too, the test runner renames the database of an alias
+    key = (alias, str(settings_dict['NAME']), settings_dict['HOST'], settings_dict['PORT'], settings_dict['USER'])
+    with pools_lock:
+        if key not in pools:
+            options = {name.lower(): value for name, value in (settings_dict.get('POOL') or {}).items()}
+            pools[key] = ConnectionPool(**options)
+        return pools[key]
+
+
+def pool_stats():
+    '''
+    stats() of every pool in the process, with the alias and name of its database.
+    '''
+    with pools_lock:
+        items = list(pools.items())
+    return [{'alias': alias, 'database': name, **pool.stats()} for (alias, name, *_), pool in items]
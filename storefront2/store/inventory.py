@@ -0,0 +1,127 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from .cache import invalidate
+from .models import CartItem, Product, Reservation
+
+
+# Stock is taken with a conditional UPDATE ... SET inventory = inventory - n WHERE inventory >= n, so it can never go
+# below zero and no row is held locked longer than the transaction that takes it. Rows are always locked in primary
+# key order, which keeps two checkouts sharing products from deadlocking each other. Nested in a caller's transaction,
+# take_stock(), release() and checkout_cart() don't take a savepoint of their own and leave a failure to roll back
+# with it. reserve_cart() keeps one, its OutOfStock is caught by callers that go on using the connection.
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for products {product_ids}')
+        self.product_ids = product_ids
+
+
+def per_product(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField()
+    )
+
+
+def lock_products(product_ids):
+    '''
+    Locks the products in primary key order until the end of the transaction, returns {product_id: inventory}.
+    '''
+    return dict(Product.objects.select_for_update()
+                               .filter(pk__in=product_ids)
+                               .order_by('pk')
+                               .values_list('pk', 'inventory'))
+
+
+def take_stock(quantities, locked=None):
+    '''
+    Takes {product_id: quantity} off the inventory, all or nothing. Raises OutOfStock naming the short products.
+    `locked` is the result of an earlier lock_products() in the same transaction that covered these products.
+    '''
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    with transaction.atomic(savepoint=False):
+        if locked is None:
+            locked = lock_products(quantities)
+        short = sorted(product_id for product_id, quantity in quantities.items() if locked.get(product_id, 0) < quantity)
+        if short:
+            raise OutOfStock(short)
+
+        wanted = per_product(quantities)
+        updated = Product.objects.filter(pk__in=quantities, inventory__gte=wanted) \
+                                 .update(inventory=F('inventory') - wanted)
+        if updated != len(quantities):
+            # only reachable on databases without row locks, the atomic block rolls back the rows that did update
+            raise OutOfStock(sorted(quantities))
+    # queryset.update() skips the Product signals, so drop the cached catalogue pages here
+    invalidate('products')
+
+
+def return_stock(quantities):
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(inventory=F('inventory') + per_product(quantities))
+        invalidate('products')
+
+
+def release(reservations):
+    '''
+    Deletes the given reservations and puts their stock back.
+    '''
+    with transaction.atomic(savepoint=False):
+        rows = list(reservations.select_for_update().order_by('pk').values_list('pk', 'product_id', 'quantity'))
+        quantities = Counter()
+        for _, product_id, quantity in rows:
+            quantities[product_id] += quantity
+        return_stock(quantities)
+        Reservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    return len(rows)
+
+
+def release_expired():
+    # carts that were deleted leave their reservations behind with no cart
+    return release(Reservation.objects.filter(Q(expires_at__lte=timezone.now()) | Q(cart__isnull=True)))
+
+
+def reserve_cart(cart_id):
+    '''
+    Holds the stock for everything in the cart until the reservation expires, replacing any earlier reservation.
+    Returns the expiry time.
+    '''
+    minutes = getattr(settings, 'STORE_RESERVATION_MINUTES', 15)
+    expires_at = timezone.now() + timedelta(minutes=minutes)
+    with transaction.atomic():
+        release(Reservation.objects.filter(cart_id=cart_id))
+        quantities = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+        take_stock(quantities)
+        Reservation.objects.bulk_create([
+            Reservation(cart_id=cart_id, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items()
+        ])
+    return expires_at
+
+
+def checkout_cart(cart_id, quantities):
+    '''
+    Takes the stock for an order of {product_id: quantity} placed from the cart. Whatever the cart already reserved is
+    used up first, even if it expired but hasn't been released yet, and only the difference is taken from the inventory.
+    '''
+    with transaction.atomic(savepoint=False):
+        reservations = Reservation.objects.filter(cart_id=cart_id)
+        reserved = Counter()
+        rows = reservations.select_for_update().order_by('pk').values_list('product_id', 'quantity')
+        for product_id, quantity in rows:
+            reserved[product_id] += quantity
+        # every product either UPDATE below touches, locked before the first of them writes. A product is only ever
+        # returned or taken, never both, so the inventory read here is still current for take_stock()
+        locked = lock_products(set(reserved) | set(quantities))
+        reservations.delete()
+
+        return_stock({product_id: reserved[product_id] - quantities.get(product_id, 0) for product_id in reserved})
+        take_stock({product_id: quantity - reserved[product_id] for product_id, quantity in quantities.items()}, locked)
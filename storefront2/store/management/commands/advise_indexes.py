@@ -0,0 +1,100 @@
+import json
+import re
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+from store.queries import query_shape
+
+
+# "SCAN store_product", "SCAN TABLE store_product AS U0" before SQLite 3.36, or just "SCAN U0" for an aliased table
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?"?(?P<name>\w+)"?(?: AS "?(?P<alias>\w+)"?)?')
+# the aliases Django gives tables in subqueries and joins, FROM "store_product" U0
+SQL_ALIAS = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?\b')
+
+
+def explain_sqlite(cursor, sql, params, tables):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    aliases = {alias: table for table, alias in SQL_ALIAS.findall(sql)}
+    problems = []
+    for row in cursor.fetchall():
+        detail = row[-1]
+        scan = SQLITE_SCAN.match(detail)
+        if scan and 'INDEX' not in detail:
+            table = aliases.get(scan['name'], scan['name'])
+            if table in tables:
+                problems.append(f'full scan of {table}')
+        elif detail.startswith('USE TEMP B-TREE'):
+            problems.append(f'filesort ({detail.lower()})')
+    return problems
+
+
+def explain_mysql(cursor, sql, params, tables):
+    cursor.execute('EXPLAIN ' + sql, params)
+    columns = [column[0].lower() for column in cursor.description]
+    problems = []
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        extra = row.get('extra') or ''
+        if row.get('table') in tables and row.get('type') in ('ALL', 'index'):
+            kind = 'full scan' if row['type'] == 'ALL' else 'full index scan'
+            problems.append(f"{kind} of {row['table']} (~{row.get('rows')} rows)")
+        if 'Using filesort' in extra or 'Using temporary' in extra:
+            problems.append(f"filesort on {row.get('table')} ({extra})")
+    return problems
+
+
+EXPLAINERS = {
+    'sqlite': explain_sqlite,
+    'mysql': explain_mysql,
+}
+
+
+class Command(BaseCommand):
+    help = 'Replays a query log captured with STORE_QUERY_LOG through EXPLAIN, once per query shape, ' \
+           'and reports full table scans and filesorts on the tables of the given apps, costliest first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='JSON lines file written by store.middleware.QueryBudgetMiddleware')
+        parser.add_argument('--apps', nargs='+', default=['store', 'tags', 'likes'])
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        explain = EXPLAINERS.get(connection.vendor)
+        if explain is None:
+            raise CommandError(f'EXPLAIN parsing is not implemented for {connection.vendor}')
+
+        tables = {model._meta.db_table
+                  for app_label in options['apps']
+                  for model in apps.get_app_config(app_label).get_models()}
+
+        # one sample query per shape, with how often the shape ran and for how long in total
+        shapes = {}
+        with open(options['log']) as log:
+            for line in log:
+                query = json.loads(line)
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                if not any(table in sql for table in tables):
+                    continue
+                shape = shapes.setdefault(query_shape(sql), {'sql': sql, 'params': query['params'], 'count': 0, 'ms': 0})
+                shape['count'] += 1
+                shape['ms'] += query['ms']
+
+        reported = 0
+        with connection.cursor() as cursor:
+            for shape, query in sorted(shapes.items(), key=lambda item: item[1]['ms'], reverse=True):
+                try:
+                    problems = explain(cursor, query['sql'], query['params'], tables)
+                except DatabaseError as error:
+                    self.stderr.write(f'Could not explain {shape}: {error}')
+                    continue
+                if not problems:
+                    continue
+                reported += 1
+                self.stdout.write(self.style.WARNING(f"{query['count']} runs, {query['ms']:.1f} ms total: {shape}"))
+                for problem in problems:
+                    self.stdout.write(f'    {problem}')
+
+        self.stdout.write(self.style.SUCCESS(f'{len(shapes)} query shapes explained, {reported} need an index.'))
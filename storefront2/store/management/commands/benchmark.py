@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from store.benchmarks import SCENARIOS, measure
+
+
+class Command(BaseCommand):
+    help = 'Times a store scenario at several sizes and reports latency and query count. Nothing is left in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        scenario = SCENARIOS[options['scenario']]
+        self.stdout.write(
+            f"{'size':>8} {'queries':>8} {'min ms':>10} {'median ms':>10} {'max ms':>10} {'us/row':>10}")
+        for size in options['sizes']:
+            result = measure(scenario, size, options['repeat'])
+            self.stdout.write(
+                f"{result['size']:>8} {result['queries']:>8} {result['min_ms']:>10.2f} "
+                f"{result['median_ms']:>10.2f} {result['max_ms']:>10.2f} {result['per_row_us']:>10.1f}")
@@ -0,0 +1,81 @@
+import json
+import platform
+from django import get_version
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+from store.benchmarks import API_SCENARIOS, compare, run_api, seed_dataset
+
+
+class Command(BaseCommand):
+    help = ('Seeds a synthetic store into a fresh test database and sends API requests through the test client, '
+            'reporting latency percentiles, queries and memory per scenario. --save-baseline writes the results to '
+            'a file, --baseline compares against one and fails on regressions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"all of them by default: {', '.join(API_SCENARIOS)}")
+        parser.add_argument('--scale', type=int, default=1000, help='number of products, the rest scales with it')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=50, help='timed requests per scenario, at least 2')
+        parser.add_argument('--cache', action='store_true', help="Keep the response cache on, it's off by default.")
+        parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+        parser.add_argument('--save-baseline', help='file to write the results to')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='fraction latency and memory may grow over the baseline, default 0.2')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 2:
+            raise CommandError('--repeat must be at least 2')
+        names = options['scenarios'] or list(API_SCENARIOS)
+        unknown = set(names) - set(API_SCENARIOS)
+        if unknown:
+            raise CommandError(f"No scenario {', '.join(sorted(unknown))}, choose from {', '.join(API_SCENARIOS)}")
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={DEFAULT_DB_ALIAS})
+        try:
+            dataset = seed_dataset(options['scale'], options['seed'])
+            results = run_api(dataset, names, options['repeat'], options['cache'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'scenario':<20} {'requests':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+                          f"{'max ms':>8} {'queries':>8} {'peak KiB':>9}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<20} {result['requests']:>8} {result['p50_ms']:>8.2f} {result['p90_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} {result['queries']:>8} {result['peak_kb']:>9.1f}")
+
+        run = {
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'cache': options['cache'],
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'django': get_version(),
+            'results': results,
+        }
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(run, file, indent=2)
+        if options['baseline']:
+            self.compare(run, options['baseline'], options['tolerance'])
+
+    def compare(self, run, path, tolerance):
+        with open(path) as file:
+            baseline = json.load(file)
+        for key in ('scale', 'seed', 'cache', 'vendor'):
+            if baseline.get(key) != run[key]:
+                self.stderr.write(f'The baseline was taken with {key}={baseline.get(key)}, this run has {run[key]}.')
+
+        self.stdout.write(f"\n{'scenario':<20} {'metric':<8} {'baseline':>10} {'current':>10} {'change':>8}")
+        regressions = 0
+        for name, metric, old, new, change, regressed in compare(run['results'], baseline['results'], tolerance):
+            regressions += regressed
+            line = f'{name:<20} {metric:<8} {old:>10.2f} {new:>10.2f} {change:>+8.1%}'
+            self.stdout.write(self.style.ERROR(line + '  regressed') if regressed else line)
+        if regressions:
+            raise CommandError(f'{regressions} regressions against {path}')
@@ -0,0 +1,43 @@
+import csv
+import json
+from django.core.management.base import BaseCommand
+from store.models import Product
+from .import_products import FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Streams the catalogue out as CSV or NDJSON in the format import_products reads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help='file to write, or - for stdout')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def rows(self, chunk_size):
+        # keyset batches on the primary key: mysqlclient buffers a whole result set client side, so a single
+        # iterator() over the table would not keep memory flat there
+        columns = ['id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'collection__title']
+        last_id = 0
+        while True:
+            batch = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list(*columns)[:chunk_size])
+            if not batch:
+                return
+            for id, *values in batch:
+                yield dict(zip(FIELDS, values))
+            last_id = batch[-1][0]
+
+    def handle(self, *args, **options):
+        path = options['output']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        stream = self.stdout if path == '-' else open(path, 'w', newline='' if format == 'csv' else None)
+        try:
+            if format == 'csv':
+                writer = csv.DictWriter(stream, FIELDS)
+                writer.writeheader()
+                writer.writerows(self.rows(options['chunk_size']))
+            else:
+                for row in self.rows(options['chunk_size']):
+                    stream.write(json.dumps(row, default=str) + '\n')
+        finally:
+            if stream is not self.stdout:
+                stream.close()
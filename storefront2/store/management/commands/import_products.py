@@ -0,0 +1,141 @@
+import csv
+import json
+import sys
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from store import pricing
+from store.cache import invalidate
+from store.models import Collection, Product
+from store.search import get_search_backend
+
+
+FIELDS = ['title', 'slug', 'description', 'unit_price', 'inventory', 'collection']
+
+
+def read_rows(stream, format):
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Streams products from CSV or NDJSON into the catalogue in chunks, updating the products whose slug ' \
+           'already exists and creating the rest. The collection column holds the collection title.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to read, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--create-collections', action='store_true',
+                            help='create collections that do not exist yet instead of skipping their products')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        self.create_collections = options['create_collections']
+        self.collections = {}
+        self.created = self.updated = self.skipped = 0
+
+        stream = sys.stdin if path == '-' else open(path, newline='' if format == 'csv' else None)
+        try:
+            for number, chunk in enumerate(chunks(read_rows(stream, format), options['chunk_size'])):
+                self.import_chunk(chunk, first_line=number * options['chunk_size'] + 1)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # bulk writes skip the Product signals, so catch up on what they maintain
+        call_command('recount_collection_products', stdout=self.stdout)
+        invalidate('products', 'collections')
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.created} products created, {self.updated} updated, {self.skipped} skipped.'))
+
+    def collection_id(self, title):
+        # one query per distinct collection title for the whole import
+        if title not in self.collections:
+            collection = Collection.objects.filter(title=title).order_by('id').first()
+            if collection is None and self.create_collections:
+                collection = Collection.objects.create(title=title)
+            self.collections[title] = collection.id if collection else None
+        return self.collections[title]
+
+    def parse(self, row):
+        collection_id = self.collection_id(row['collection'])
+        if collection_id is None:
+            raise ValueError(f"no collection titled {row['collection']!r}")
+        unit_price = Decimal(str(row['unit_price']))
+        product = Product(
+            title=row['title'],
+            slug=row['slug'],
+            description=row.get('description') or None,
+            unit_price=unit_price,
+            inventory=int(row['inventory']),
+            collection_id=collection_id,
+            last_update=timezone.now(),
+        )
+        # the model's validators and max_digits, one row the database rejects would fail its whole chunk. The
+        # collection was looked up above
+        product.clean_fields(exclude=['collection'])
+        product.price_with_tax = pricing.price_with_tax(unit_price)
+        return product
+
+    def import_chunk(self, rows, first_line):
+        products = {}
+        for line, row in enumerate(rows, first_line):
+            try:
+                product = self.parse(row)
+            except ValidationError as error:
+                errors = '; '.join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+                self.stderr.write(f'row {line}: {errors}, skipped')
+                self.skipped += 1
+                continue
+            except (KeyError, ValueError, InvalidOperation) as error:
+                self.stderr.write(f'row {line}: {error!r}, skipped')
+                self.skipped += 1
+                continue
+            # the last row wins when a slug repeats
+            products[product.slug] = product
+
+        with transaction.atomic():
+            existing = dict(Product.objects.filter(slug__in=products).order_by('-id').values_list('slug', 'id'))
+            to_update, to_create = [], []
+            for slug, product in products.items():
+                if slug in existing:
+                    product.id = existing[slug]
+                    to_update.append(product)
+                else:
+                    to_create.append(product)
+
+            # existing rows go through INSERT ... ON CONFLICT (id) / ON DUPLICATE KEY UPDATE, which is far cheaper
+            # than the CASE WHEN statements bulk_update() builds
+            Product.objects.bulk_create(
+                to_update,
+                update_conflicts=True,
+                unique_fields=['id'] if connection.features.supports_update_conflicts_with_target else None,
+                update_fields=['title', 'description', 'unit_price', 'inventory', 'collection', 'last_update',
+                               'price_with_tax']
+            )
+            Product.objects.bulk_create(to_create)
+
+            # MySQL doesn't hand back the ids of bulk_create
+            ids = list(Product.objects.filter(slug__in=products).values_list('id', flat=True))
+            get_search_backend().reindex(ids)
+            # the prices above leave out promotions, which only products that already existed can have
+            pricing.refresh_prices(existing.values())
+
+        self.created += len(to_create)
+        self.updated += len(to_update)
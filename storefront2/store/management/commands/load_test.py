@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from store.benchmarks import load, seed_catalogue
+
+
+class Command(BaseCommand):
+    help = ('Sends concurrent catalogue reads through the ASGI handler and compares requests/sec and latency '
+            'of the sync and the async viewsets. The seeded products are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--cache', action='store_true', help="Keep the response cache on, it's off by default.")
+
+    def handle(self, *args, **options):
+        product_ids, cleanup = seed_catalogue(options['products'])
+        urls = [
+            '/store/products/',
+            '/store/products/?cursor=&ordering=-unit_price',
+            '/store/collections/',
+            f'/store/products/{product_ids[0]}/reviews/',
+        ] + [f'/store/products/{product_id}/' for product_id in product_ids[:20]]
+
+        try:
+            self.stdout.write(
+                f"{'views':>6} {'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+            for concurrency in options['concurrency']:
+                for async_views in (False, True):
+                    result = load(urls, concurrency, options['requests'], async_views, options['cache'])
+                    self.stdout.write(
+                        f"{'async' if async_views else 'sync':>6} {result['concurrency']:>8} {result['requests']:>9} "
+                        f"{result['errors']:>7} {result['rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+        finally:
+            cleanup()
@@ -0,0 +1,50 @@
+import sys
+import time
+from django.core.management.base import BaseCommand
+from store.serializers import ProvisionCustomerSerializer
+from .import_products import chunks, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Signs up users with their customers from CSV or NDJSON in chunks, with columns username, email, ' \
+           'password, first_name, last_name, phone, birth_date and membership. Rows with a taken username or email ' \
+           'or an invalid value are reported and skipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to read, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--processes', type=int,
+                            help='worker processes hashing passwords, defaults to STORE_PASSWORD_HASHING_PROCESSES')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        created = skipped = 0
+        start = time.perf_counter()
+
+        stream = sys.stdin if path == '-' else open(path, newline='' if format == 'csv' else None)
+        try:
+            for number, chunk in enumerate(chunks(read_rows(stream, format), options['chunk_size'])):
+                if format == 'csv':
+                    # empty cells are missing values, the serializer's defaults apply
+                    chunk = [{key: value for key, value in row.items() if value != ''} for row in chunk]
+                serializer = ProvisionCustomerSerializer(
+                    data=chunk, many=True, context={'partial_rows': True, 'processes': options['processes']})
+                serializer.is_valid(raise_exception=True)
+                customers = serializer.save()
+
+                first_line = number * options['chunk_size'] + 1
+                for row_error in serializer.row_errors:
+                    errors = '; '.join(f"{field}: {' '.join(map(str, messages))}"
+                                       for field, messages in row_error['errors'].items())
+                    self.stderr.write(f"row {first_line + row_error['index']}: {errors}, skipped")
+                created += len(customers)
+                skipped += len(serializer.row_errors)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        duration = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} customers created, {skipped} skipped in {duration:.1f}s.'))
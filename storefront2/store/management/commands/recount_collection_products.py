@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from store.cache import invalidate
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Collection.products_count from the product table and repairs any drifted counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the collections that are out of sync.')
+
+    def handle(self, *args, **options):
+        actual = Collection.objects.actual_products_count()
+
+        with transaction.atomic():
+            drifted = Collection.objects.annotate(actual_count=actual) \
+                                        .filter(~Q(products_count=F('actual_count')))
+            for collection in drifted.values('id', 'title', 'products_count', 'actual_count'):
+                self.stdout.write(
+                    f"{collection['title']} (#{collection['id']}): "
+                    f"{collection['products_count']} -> {collection['actual_count']}")
+
+            if options['dry_run']:
+                return
+            # one UPDATE ... SET products_count = (SELECT COUNT(*) ...) over the drifted rows only
+            repaired = Collection.objects.recount_products(list(drifted.values_list('pk', flat=True)))
+            invalidate('collections')
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} collections.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store import pricing
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Product.price_with_tax for every product, run it after changing STORE_TAX_RATE.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        changed = pricing.refresh_prices(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Repriced {changed} products.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from store.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Returns the stock held by expired or abandoned cart reservations. Meant to run every few minutes from cron.'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} reservations.'))
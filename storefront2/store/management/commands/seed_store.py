@@ -0,0 +1,52 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from store.seeding import Plan, seed
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic store: products with promotions, tags and reviews, users with their customers, '
+            'orders, carts and likes, added after the existing rows. The same options and seed always generate the '
+            'same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--customers', type=int, help='defaults to a tenth of the products')
+        parser.add_argument('--orders', type=int, help='defaults to two per customer')
+        parser.add_argument('--carts', type=int, help='defaults to one per two customers')
+        parser.add_argument('--likes', type=int, default=5, help='products liked per customer')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--password', help='password of every generated user, by default they have none')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--processes', type=int, default=1,
+                            help='worker processes writing chunks in parallel, worth it on MySQL, '
+                                 'SQLite only lets one of them write at a time')
+
+    def handle(self, *args, **options):
+        plan = Plan(seed=options['seed'], products=options['products'], customers=options['customers'],
+                    orders=options['orders'], carts=options['carts'], likes=options['likes'],
+                    password=options['password'], chunk_size=options['chunk_size'])
+        if plan.counts['order'] and not plan.counts['customer']:
+            raise CommandError('Orders need customers to belong to')
+        if (plan.counts['order'] or plan.counts['cart'] or plan.likes and plan.counts['customer']) \
+                and not plan.counts['product']:
+            raise CommandError('Orders, carts and likes need products')
+
+        if options['processes'] > 1 and connection.vendor == 'sqlite':
+            self.stderr.write('SQLite lets one process write at a time, the workers will mostly wait for each other '
+                              "and need a 'timeout' in the database OPTIONS longer than a chunk takes to write.")
+
+        verbosity = options['verbosity']
+        start = time.perf_counter()
+
+        def progress(name, counts):
+            if verbosity > 1:
+                self.stdout.write(f'{name}: {counts["product"]} products, {counts["customer"]} customers, '
+                                  f'{counts["order"]} orders')
+
+        counts = seed(plan, options['processes'], progress)
+        duration = time.perf_counter() - start
+        for name, count in sorted(counts.items()):
+            self.stdout.write(f'{name:<16} {count:>12}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(counts.values())} rows in {duration:.1f}s ({sum(counts.values()) / duration:.0f} rows/s).'))
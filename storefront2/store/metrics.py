@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .db.pool import pool_stats
+
+
+# In-process request metrics per router route, recorded by store.middleware.MetricsMiddleware and served in the
+# Prometheus text format by store.views.MetricsView.
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# histogram, Prometheus name, help, and the factor from the recorded unit, microseconds for times, to the exported one
+METRICS = [
+    ('duration', 'store_request_duration_seconds', 'Wall time of the request', 1e-6),
+    ('sql', 'store_request_sql_seconds', 'Time spent in SQL queries', 1e-6),
+    ('queries', 'store_request_queries', 'Number of SQL queries', 1),
+    ('serialize', 'store_request_serialize_seconds',
+     'Time spent building the response body from rows and rendering it', 1e-6),
+    ('size', 'store_response_size_bytes', 'Size of the response body', 1),
+]
+
+sample = ContextVar('store_metrics_sample', default=None)
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    '''
+    HDR-style histogram of non-negative integers. Values below 2**precision are counted exactly, larger ones in
+    buckets no wider than 1/2**(precision - 1) of their value, so memory stays small at any range and percentiles
+    keep about two significant digits. Only the buckets that were hit are kept.
+    '''
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.counts = Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = max(int(value), 0)
+        shift = max(value.bit_length() - self.precision, 0)
+        # (shift, value >> shift) sorts in value order
+        self.counts[shift, value >> shift] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, quantile):
+        '''
+        The highest value in the bucket holding the quantile, never more than the largest value recorded.
+        '''
+        if not self.count:
+            return 0
+        rank = quantile * self.count
+        seen = 0
+        for (shift, bucket), count in sorted(self.counts.items()):
+            seen += count
+            if seen >= rank:
+                return min(((bucket + 1) << shift) - 1, self.max)
+        return self.max
+
+
+class Sample:
+    '''
+    What one request spent, filled in while it runs. route and action are set once the request reaches a viewset.
+    '''
+    def __init__(self, profile=False):
+        self.route = self.action = None
+        self.serialize = 0.0
+        self.profile = profile
+        self.profiler = None
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, name, getattr(self, name) + time.perf_counter() - start)
+
+
+@contextmanager
+def timed(name):
+    # adds the time of the block to the current request's sample, if it is being measured
+    current = sample.get()
+    if current is None:
+        yield
+        return
+    with current.timed(name):
+        yield
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.routes = {}
+            self.responses = Counter()
+
+    def record(self, route, action, status, duration, sql, queries, serialize, size):
+        # sql and queries are None without a QueryRecorder, size for streamed responses
+        values = {'duration': duration * 1e6, 'sql': None if sql is None else sql * 1e6, 'queries': queries,
+                  'serialize': serialize * 1e6, 'size': size}
+        with self.lock:
+            histograms = self.routes.get((route, action))
+            if histograms is None:
+                histograms = self.routes[route, action] = {name: Histogram() for name, *_ in METRICS}
+            for name, value in values.items():
+                if value is not None:
+                    histograms[name].record(value)
+            self.responses[route, action, status] += 1
+
+    def render(self):
+        '''
+        Everything recorded, and the connection pools of store.db.backends, in the Prometheus text format.
+        '''
+        with self.lock:
+            lines = []
+            for name, metric, help, factor in METRICS:
+                lines += [f'# HELP {metric} {help}', f'# TYPE {metric} summary']
+                for (route, action), histograms in sorted(self.routes.items()):
+                    histogram = histograms[name]
+                    labels = f'route="{label(route)}",action="{label(action)}"'
+                    for quantile in QUANTILES:
+                        value = histogram.percentile(quantile) * factor
+                        lines.append(f'{metric}{{{labels},quantile="{quantile}"}} {value:g}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.total * factor:g}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+
+            lines += ['# HELP store_responses_total Responses by route and status',
+                      '# TYPE store_responses_total counter']
+            for (route, action, status), count in sorted(self.responses.items()):
+                labels = f'route="{label(route)}",action="{label(action)}",status="{status}"'
+                lines.append(f'store_responses_total{{{labels}}} {count}')
+
+        pools = pool_stats()
+        for key, kind in [('open', 'gauge'), ('in_use', 'gauge'), ('idle', 'gauge'), ('waits', 'counter'),
+                          ('timeouts', 'counter')]:
+            metric = f'store_db_pool_{key}' + ('_total' if kind == 'counter' else '')
+            lines += [f'# HELP {metric} Connection pool {key.replace("_", " ")}', f'# TYPE {metric} {kind}']
+            for pool in pools:
+                labels = f'alias="{label(pool["alias"])}",database="{label(pool["database"])}"'
+                lines.append(f'{metric}{{{labels}}} {pool[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,238 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from .metrics import Sample, registry, sample
+from .queries import QueryBudgetExceeded, QueryRecorder
+from .routers import Routing, get_replicas, replica_monitor, routing
+
+
+logger = logging.getLogger('store.queries')
+
+PIN_COOKIE = 'store_primary'
+
+
+class QueryBudgetMiddleware:
+    '''
+    Records the queries of every request to a view in STORE_QUERY_BUDGET_MODULES and checks them against the
+    view's query_budget, either a number or a {action: number} dict, and for repeated query shapes (N+1).
+    Actions listed in the view's query_budget_exempt, whose queries grow with the request body by design, are skipped.
+    Violations raise QueryBudgetExceeded when STORE_QUERY_BUDGET_STRICT is on (the test runner turns it on)
+    and are logged as JSON otherwise. With STORE_QUERY_LOG set every query is also appended to that file.
+    Works in both sync and async middleware chains, so it doesn't push async views onto a thread under ASGI.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryRecorder() as recorder:
+            request.query_recorder = recorder
+            start = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - start
+        return self.finish(request, response, recorder, duration)
+
+    async def __acall__(self, request):
+        # connections belong to a thread, the one sync_to_async() runs all of this request's queries in
+        recorder = request.query_recorder = QueryRecorder()
+        await sync_to_async(recorder.__enter__)()
+        try:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            duration = time.perf_counter() - start
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        return self.finish(request, response, recorder, duration)
+
+    def finish(self, request, response, recorder, duration):
+        view = getattr(request, 'query_budget_view', None)
+        if view is not None:
+            query_log = getattr(settings, 'STORE_QUERY_LOG', None)
+            if query_log:
+                recorder.write_log(query_log)
+            self.check(request, response, *view, recorder, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        modules = getattr(settings, 'STORE_QUERY_BUDGET_MODULES', ['store.views'])
+        if view_class is not None and view_class.__module__ in modules:
+            # viewsets map each http method to an action, e.g. {'get': 'list', 'post': 'create'}
+            actions = getattr(view_func, 'actions', None) or {}
+            request.query_budget_view = (view_class, actions.get(request.method.lower()))
+
+    def check(self, request, response, view_class, action, recorder, duration):
+        if action in getattr(view_class, 'query_budget_exempt', ()):
+            return
+        budget = getattr(view_class, 'query_budget', None)
+        if isinstance(budget, dict):
+            budget = budget.get(action)
+        problems = recorder.problems(budget)
+        if not problems:
+            return
+
+        view = f'{view_class.__name__}.{action}' if action else view_class.__name__
+        if getattr(settings, 'STORE_QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(f'{request.method} {request.path} ({view}): ' + '; '.join(problems))
+
+        logger.warning(json.dumps({
+            'event': 'query_budget_exceeded',
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'budget': budget,
+            'sql_ms': round(recorder.sql_time * 1000, 2),
+            'duration_ms': round(duration * 1000, 2),
+            'problems': problems,
+        }))
+
+
+class ReplicaRoutingMiddleware:
+    '''
+    Lets store.routers.ReplicaRouter read the catalogue of GET, HEAD and OPTIONS requests from a replica in
+    STORE_READ_REPLICAS. Requests that write set a cookie that keeps the client's reads on the primary for
+    STORE_REPLICA_PIN_SECONDS, so clients see their own writes. Replica lag is measured here when it is due.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.start(request)
+        if not state.primary and replica_monitor.needs_refresh():
+            replica_monitor.refresh()
+        token = routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        if not state.primary and replica_monitor.needs_refresh():
+            await sync_to_async(replica_monitor.refresh)()
+        token = routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing.reset(token)
+        return self.finish(response, state)
+
+    def start(self, request):
+        primary = not get_replicas() or request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+        return Routing(primary)
+
+    def finish(self, response, state):
+        if get_replicas() and state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'STORE_REPLICA_PIN_SECONDS', 10),
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class MetricsMiddleware:
+    '''
+    Records the wall time, SQL time and query count, serialization time and response size of every request to a
+    router viewset into store.metrics.registry, per route (the router basename) and action. The queries come from
+    QueryBudgetMiddleware, which has to come later in MIDDLEWARE. Routes in STORE_PROFILE_ROUTES, {route: fraction},
+    run that fraction of their requests under cProfile and write the stats to STORE_PROFILE_DIR. Only sync requests
+    are profiled, on the event loop the profile would take in every other request too.
+    '''
+    sync_capable = True
+    async_capable = True
+    # one profile at a time, a thread can only have one profiler running
+    profile_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        current = request.metrics_sample = Sample(profile=True)
+        token = sample.set(current)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            sample.reset(token)
+            self.stop_profile(current)
+        return self.finish(request, response, current, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        current = request.metrics_sample = Sample()
+        token = sample.set(current)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            sample.reset(token)
+        return self.finish(request, response, current, time.perf_counter() - start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current = getattr(request, 'metrics_sample', None)
+        route = (getattr(view_func, 'initkwargs', None) or {}).get('basename')
+        if current is None or route is None:
+            return
+        actions = getattr(view_func, 'actions', None) or {}
+        current.route, current.action = route, actions.get(request.method.lower(), '')
+
+        rate = getattr(settings, 'STORE_PROFILE_ROUTES', {}).get(route)
+        if current.profile and rate and random.random() < rate and self.profile_lock.acquire(blocking=False):
+            current.profiler = cProfile.Profile()
+            current.profiler.enable()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this
+        current = getattr(request, 'metrics_sample', None)
+        if current is not None and current.route is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                current.serialize += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def stop_profile(self, current):
+        if current.profiler is not None:
+            current.profiler.disable()
+            self.profile_lock.release()
+
+    def finish(self, request, response, current, duration):
+        if current.route is None:
+            return response
+        recorder = getattr(request, 'query_recorder', None)
+        registry.record(
+            current.route, current.action, response.status_code, duration,
+            sql=recorder.sql_time if recorder else None, queries=recorder.count if recorder else None,
+            serialize=current.serialize, size=None if response.streaming else len(response.content))
+
+        if current.profiler is not None:
+            directory = getattr(settings, 'STORE_PROFILE_DIR', 'profiles')
+            os.makedirs(directory, exist_ok=True)
+            name = f'{current.route}.{current.action or request.method.lower()}.{time.time_ns()}.prof'
+            current.profiler.dump_stats(os.path.join(directory, name))
+        return response
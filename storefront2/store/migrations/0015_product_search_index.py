@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE store_product ADD FULLTEXT INDEX store_product_fulltext (title, description)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE store_product_fts USING fts5(title, description)')
+        schema_editor.execute(
+            'INSERT INTO store_product_fts (rowid, title, description) '
+            "SELECT id, title, COALESCE(description, '') FROM store_product")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE store_product DROP INDEX store_product_fulltext')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE store_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.4 on 2026-10-18 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_reservation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['title'], name='store_colle_title_ddb562_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'placed_at'], name='store_order_custome_700a25_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['placed_at', 'id'], name='store_order_placed__61eeee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'placed_at'], name='store_order_payment_11d454_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['collection', 'unit_price'], name='store_produ_collect_5f8db0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'date'], name='store_revie_product_a44095_idx'),
+        ),
+    ]
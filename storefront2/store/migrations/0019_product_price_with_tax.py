@@ -0,0 +1,38 @@
+# Generated by Django 4.2.4 on 2026-10-18 04:10
+
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def price_products(apps, schema_editor):
+    # same arithmetic as store.pricing.price_with_tax at the time of this migration
+    Product = apps.get_model('store', 'Product')
+    tax_rate = Decimal(str(getattr(settings, 'STORE_TAX_RATE', '0.10')))
+    products = Product.objects.annotate(discount=Max('promotions__discount')).order_by('pk')
+    last_pk = 0
+    while rows := list(products.filter(pk__gt=last_pk).values_list('pk', 'unit_price', 'discount')[:1000]):
+        Product.objects.bulk_update([
+            Product(pk=pk, price_with_tax=(
+                unit_price * (1 - min(max(Decimal(str(discount or 0)), Decimal(0)), Decimal(1))) * (1 + tax_rate)
+            ).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+            for pk, unit_price, discount in rows
+        ], ['price_with_tax'])
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price_with_tax',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.RunPython(price_products, migrations.RunPython.noop),
+    ]
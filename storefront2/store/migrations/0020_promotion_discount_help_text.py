@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_product_price_with_tax'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='promotion',
+            name='discount',
+            field=models.FloatField(help_text='Fraction taken off the unit price, 0.2 is 20% off. Values outside 0 to 1 are clamped to that range.'),
+        ),
+    ]
@@ -1,25 +1,58 @@
 from uuid import uuid4
 from django.core.validators import MinValueValidator
 from django.contrib import admin
-from django.db import models
+from django.db import connections, models, router
+from django.db.models.functions import Coalesce
 from django.conf import settings
 
 
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
-    discount = models.FloatField()
+    discount = models.FloatField(
+        help_text='Fraction taken off the unit price, 0.2 is 20% off. Values outside 0 to 1 are clamped to that range.')
+
+
+class CollectionManager(models.Manager):
+    def actual_products_count(self):
+        # COUNT(*) of the collection's products as a correlated subquery
+        return Coalesce(models.Subquery(
+            Product.objects.filter(collection=models.OuterRef('pk'))
+                           .order_by()
+                           .values('collection')
+                           .annotate(count=models.Count('id'))
+                           .values('count')
+        ), 0)
+
+    def recount_products(self, pks):
+        '''
+        Sets products_count of the given collections from the product table, for writes that skip the Product signals.
+        '''
+        return self.filter(pk__in=pks).update(products_count=self.actual_products_count())
 
 
 class Collection(models.Model):
+    objects = CollectionManager()
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    # maintained by the Product signals in store.signals.handlers, repaired by ./manage.py recount_collection_products
+    products_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # writing back the products_count this instance loaded would undo products added or moved since
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'products_count']
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title'])
+        ]
 
 
 class Product(models.Model):
@@ -34,12 +67,22 @@ class Product(models.Model):
     last_update = models.DateTimeField(auto_now=True)
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
+    # unit price less the best promotion plus tax, maintained by store.pricing
+    price_with_tax = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        # keyset pagination seeks on (ordering field, id), see store.pagination.KeysetPagination
+        indexes = [
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            models.Index(fields=['last_update', 'id']),
+            # ProductFilter's collection_id with unit_price__gt/__lt
+            models.Index(fields=['collection', 'unit_price']),
+        ]
 
 
 class Customer(models.Model):
@@ -89,6 +132,14 @@ class Order(models.Model):
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [
+            # a customer's orders newest first (OrderViewSet), and the staff listing of all orders
+            models.Index(fields=['customer', 'placed_at']),
+            models.Index(fields=['placed_at', 'id']),
+            models.Index(fields=['payment_status', 'placed_at']),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name="items")
@@ -103,12 +154,65 @@ class Address(models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE)
 
+class CartManager(models.Manager):
+    def with_total_price(self):
+        # SUM(quantity * unit_price) in SQL, so products don't have to be loaded to price a cart. 0 for an empty cart
+        total_price = models.DecimalField(max_digits=14, decimal_places=2)
+        return self.annotate(total_price=Coalesce(
+            models.Sum(models.F('items__quantity') * models.F('items__product__unit_price'), output_field=total_price),
+            models.Value(0), output_field=total_price
+        ))
+
+
 class Cart(models.Model):
+    objects = CartManager()
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class CartItemManager(models.Manager):
+    # rows per INSERT, keeps the statement under SQLite's bound parameter limit
+    upsert_batch_size = 300
+
+    def with_total_price(self):
+        return self.annotate(total_price=models.ExpressionWrapper(
+            models.F('quantity') * models.F('product__unit_price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        ))
+
+    def add_items(self, cart_id, quantities):
+        '''
+        Adds {product_id: quantity} to a cart with INSERT ... ON DUPLICATE KEY / ON CONFLICT, so a product that is
+        already in the cart gets its quantity increased by the database in the same statement instead of get() + save().
+        A quantity never goes over STORE_MAX_CART_QUANTITY, sums above it are capped. Returns the affected cart items.
+        '''
+        connection = connections[self._db or router.db_for_write(self.model)]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        db_cart_id = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        # defaults to the most the quantity column holds
+        max_quantity = getattr(settings, 'STORE_MAX_CART_QUANTITY', 32767)
+
+        least = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+        if connection.vendor == 'mysql':
+            conflict = f'ON DUPLICATE KEY UPDATE quantity = {least}(quantity + VALUES(quantity), %s)'
+        else:
+            conflict = f'ON CONFLICT (cart_id, product_id) DO UPDATE SET ' \
+                       f'quantity = {least}({table}.quantity + excluded.quantity, %s)'
+
+        items = [(product_id, min(quantity, max_quantity)) for product_id, quantity in quantities.items()]
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), self.upsert_batch_size):
+                batch = items[start:start + self.upsert_batch_size]
+                rows = ', '.join(['(%s, %s, %s)'] * len(batch))
+                params = [value for product_id, quantity in batch for value in (db_cart_id, product_id, quantity)]
+                cursor.execute(f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES {rows} {conflict}',
+                               params + [max_quantity])
+
+        return self.using(connection.alias).filter(cart_id=cart_id, product_id__in=quantities)
+
+
 class CartItem(models.Model):
+    objects = CartItemManager()
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items") # cartitem_set
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField()
@@ -117,8 +221,20 @@ class CartItem(models.Model):
         # ensures there are no duplicates between these two fields
         unique_together = [['cart', 'product']]
 
+class Reservation(models.Model):
+    # stock taken off Product.inventory for a cart, see store.inventory
+    cart = models.ForeignKey(Cart, on_delete=models.SET_NULL, null=True, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveSmallIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reviews")
     name = models.CharField(max_length=255)
     description = models.TextField()
-    date = models.DateField(auto_now_add=True)
\ No newline at end of file
+    date = models.DateField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'date'])
+        ]
\ No newline at end of file
@@ -1,4 +1,179 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # paginate_queryset() with the count and the page fetched through the async ORM
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [row async for row in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return self.page.object_list
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Seeks to the next page with WHERE (field, id) > (last_field, last_id) instead of OFFSET,
+    so deep pages cost the same as the first one and no COUNT(*) is needed.
+    The sort key is always the requested ordering field plus the primary key as a tie breaker. Cursors carry the
+    ordering they were made for, one sent with another ?ordering is rejected.
+    '''
+    page_size = 10
+    cursor_query_param = 'cursor'
+    default_ordering = 'title'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request, view)])
+
+    def get_page_queryset(self, queryset, request, view):
+        self.request = request
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request, queryset.model)
+
+        # previous links walk the index backwards and flip the rows afterwards
+        reverse = bool(self.cursor and self.cursor['r'])
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + self.field, prefix + 'id')
+
+        if self.cursor:
+            value, pk = self.cursor['v'], self.cursor['id']
+            seek = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{seek}': value}) |
+                Q(**{self.field: value, f'id__{seek}': pk})
+            )
+
+        # one extra row tells us whether there is another page without counting
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        reverse = bool(self.cursor and self.cursor['r'])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else self.cursor is not None
+        self.has_previous = self.cursor is not None if not reverse else has_more
+        return rows
+
+    def get_ordering(self, request, queryset, view):
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or [self.default_ordering]
+        self.ordering = ordering[0]
+        return self.ordering.lstrip('-'), self.ordering.startswith('-')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        field, pk_field = model._meta.get_field(self.field), model._meta.pk
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if cursor['o'] != self.ordering:
+                # the client changed ?ordering and kept its cursor, which would seek to an arbitrary row
+                raise ValueError(cursor['o'])
+            # converted here so a mangled cursor is a 404 and not an error in the query
+            value, pk = field.to_python(cursor['v']), pk_field.to_python(cursor['id'])
+            # SQLite doesn't give integer fields range validators, and no backend's ids go past 64 bits
+            if value is None or pk is None or abs(pk) >= 2 ** 63:
+                raise ValueError(cursor)
+            field.run_validators(value)
+            pk_field.run_validators(pk)
+            return {'v': value, 'id': pk, 'r': bool(cursor.get('r'))}
+        except (TypeError, ValueError, KeyError, ValidationError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        # rows are model instances or .values() dicts, see store.values
+        value, pk = (row[self.field], row['id']) if isinstance(row, dict) else (getattr(row, self.field), row.pk)
+        cursor = {'o': self.ordering, 'v': value.isoformat() if hasattr(value, 'isoformat') else str(value), 'id': pk}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, '')
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class ProductPagination(DefaultPagination):
+    '''
+    Page numbers by default, keyset pages when the client opts in by sending ?cursor= (empty for the first page).
+    Keyset pages are always in ordering field order, with ?search= too: they hold the matches sorted by title (or
+    ?ordering) rather than by relevance, a search rank changes with the index and can't be seeked on.
+    '''
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        self.keyset = None
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
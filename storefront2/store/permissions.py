@@ -1,4 +1,35 @@
-from rest_framework.permissions import BasePermission, SAFE_METHODS
+from asgiref.sync import sync_to_async
+from rest_framework.permissions import AllowAny, BasePermission, SAFE_METHODS
+
+
+async def aget_user(request):
+    '''
+    request.user from async code. The authenticators may look the user up in the database, so the first access
+    runs in a thread.
+    '''
+    if '_user' not in request.__dict__:
+        await sync_to_async(lambda: request.user)()
+    return request.user
+
+
+async def ahas_permission(permission, request, view):
+    '''
+    Awaits permission.ahas_permission() when it has one. Any other permission may read request.user and runs in a thread.
+    '''
+    if hasattr(permission, 'ahas_permission'):
+        return await permission.ahas_permission(request, view)
+    if isinstance(permission, AllowAny):
+        return True
+    return await sync_to_async(permission.has_permission)(request, view)
+
+
+async def ahas_object_permission(permission, request, view, obj):
+    if hasattr(permission, 'ahas_object_permission'):
+        return await permission.ahas_object_permission(request, view, obj)
+    if type(permission).has_object_permission is BasePermission.has_object_permission:
+        return True
+    return await sync_to_async(permission.has_object_permission)(request, view, obj)
+
 
 class IsAdminorReadOnly(BasePermission):
     
@@ -6,7 +37,14 @@ class IsAdminorReadOnly(BasePermission):
         if request.method in SAFE_METHODS:
             return True
         return bool(request.user and request.user.is_staff)
+
+    async def ahas_permission(self, request, view):
+        # reads never need the user
+        if request.method in SAFE_METHODS:
+            return True
+        user = await aget_user(request)
+        return bool(user and user.is_staff)
     
 class ViewCustomerHistoryPermission(BasePermission):
     def has_permission(self, request, view):
-        return request.user.has_perm('store.view_history')
\ No newline at end of file
+        return request.user.has_perm('store.view_history')
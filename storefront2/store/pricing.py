@@ -0,0 +1,76 @@
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
+from django.db.models import Max
+from .cache import invalidate
+from .models import Product
+
+
+# Product.price_with_tax is stored so listing products never prices a row. The Product pre_save signal sets it for
+# single saves, everything else (promotion changes, bulk writes that skip the signals, a new STORE_TAX_RATE through
+# ./manage.py refresh_prices) recomputes it with refresh_prices().
+
+CENT = Decimal('0.01')
+
+
+def get_tax_rate():
+    return Decimal(str(getattr(settings, 'STORE_TAX_RATE', '0.10')))
+
+
+def price_with_tax(unit_price, discount=None, tax_rate=None):
+    '''
+    The unit price less the discount, a fraction of the price, plus tax, rounded to the cent.
+    '''
+    tax_rate = get_tax_rate() if tax_rate is None else tax_rate
+    # unit_price can still be the int or string it was assigned as before the save
+    unit_price = Decimal(str(unit_price))
+    # str() so a float discount of 0.1 is 0.1 and not 0.1000000000000000055...
+    discount = min(max(Decimal(str(discount or 0)), Decimal(0)), Decimal(1))
+    return (unit_price * (1 - discount) * (1 + tax_rate)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def best_discounts(product_ids, using='default'):
+    '''
+    {product_id: discount} of the best promotion of each of the products that has one.
+    '''
+    return dict(Product.promotions.through.objects.using(using)
+                                              .filter(product_id__in=product_ids)
+                                              .values('product_id')
+                                              .annotate(discount=Max('promotion__discount'))
+                                              .values_list('product_id', 'discount'))
+
+
+def price_rows(product_ids, using, batch_size):
+    products = Product.objects.using(using) \
+                              .annotate(discount=Max('promotions__discount')) \
+                              .order_by('pk')
+    columns = ('pk', 'unit_price', 'price_with_tax', 'discount')
+    if product_ids is not None:
+        product_ids = sorted(set(product_ids))
+        for start in range(0, len(product_ids), batch_size):
+            yield list(products.filter(pk__in=product_ids[start:start + batch_size]).values_list(*columns))
+        return
+    last_pk = 0
+    while rows := list(products.filter(pk__gt=last_pk).values_list(*columns)[:batch_size]):
+        yield rows
+        last_pk = rows[-1][0]
+
+
+def refresh_prices(product_ids=None, using='default', batch_size=1000):
+    '''
+    Recomputes price_with_tax for the given products, or all of them, in chunks and writes only the prices that
+    changed. Returns how many changed.
+    '''
+    tax_rate = get_tax_rate()
+    changed = 0
+    for rows in price_rows(product_ids, using, batch_size):
+        products = [
+            Product(pk=pk, price_with_tax=price)
+            for pk, unit_price, old_price, discount in rows
+            if (price := price_with_tax(unit_price, discount, tax_rate)) != old_price
+        ]
+        Product.objects.using(using).bulk_update(products, ['price_with_tax'])
+        changed += len(products)
+    if changed:
+        # bulk_update() skips the Product signals
+        invalidate('products')
+    return changed
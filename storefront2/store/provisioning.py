@@ -0,0 +1,87 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connections, router, transaction
+from .models import Customer
+
+
+# Bulk sign-ups, for onboarding a partner's users. A user saved on its own gets its Customer from the post_save
+# signal in store.signals.handlers, two single row INSERTs per user. provision() writes users and their customers
+# in paired bulk inserts instead, which send no signals, and hashes the passwords in a pool of processes: with
+# Django's default PBKDF2 iterations a hash takes a quarter of a second, far longer than the inserts.
+
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name']
+CUSTOMER_FIELDS = ['phone', 'birth_date', 'membership']
+
+# fewer passwords than this are hashed in the calling process, handing them to the pool costs more
+POOL_THRESHOLD = 8
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(processes):
+    # kept for the life of the process, spawning the workers takes longer than hashing a few passwords
+    with pools_lock:
+        if processes not in pools:
+            # spawned rather than forked, a fork would share the parent's database connections
+            pools[processes] = ProcessPoolExecutor(processes, mp_context=get_context('spawn'),
+                                                   initializer=django.setup)
+        return pools[processes]
+
+
+def hash_passwords(passwords, processes=None):
+    '''
+    make_password() of every password, an unusable password for None. Hashed in a pool of `processes` workers,
+    STORE_PASSWORD_HASHING_PROCESSES by default.
+    '''
+    processes = processes or getattr(settings, 'STORE_PASSWORD_HASHING_PROCESSES', None) or os.cpu_count()
+    given = [password for password in passwords if password is not None]
+    if processes < 2 or len(given) < POOL_THRESHOLD:
+        return [make_password(password) for password in passwords]
+
+    hashed = iter(get_pool(processes).map(make_password, given, chunksize=max(len(given) // (processes * 4), 1)))
+    return [make_password(None) if password is None else next(hashed) for password in passwords]
+
+
+def provision(rows, chunk_size=1000, processes=None):
+    '''
+    Creates a user and its customer for every row, a dict of USER_FIELDS, CUSTOMER_FIELDS and the password in
+    clear text, None for an unusable one. The rows are expected to be valid and their usernames and emails free,
+    see store.serializers.ProvisionCustomerSerializer. Each chunk of users goes in with one bulk insert and their
+    customers with another, in one transaction. Returns the customers with their users.
+    '''
+    User = get_user_model()
+    connection = connections[router.db_for_write(User)]
+    customers = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        # hashed before the transaction, which would otherwise stay open for as long as the hashing takes
+        passwords = hash_passwords([row.get('password') for row in chunk], processes)
+        users = [User(password=password, **{field: row[field] for field in USER_FIELDS if field in row})
+                 for row, password in zip(chunk, passwords)]
+
+        with transaction.atomic(using=connection.alias):
+            User.objects.using(connection.alias).bulk_create(users)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # MySQL doesn't hand back the ids of bulk_create
+                ids = dict(User.objects.using(connection.alias).filter(username__in=[user.username for user in users])
+                                                                .values_list('username', 'id'))
+                for user in users:
+                    user.id = ids[user.username]
+
+            chunk_customers = [Customer(user=user, **{field: row[field] for field in CUSTOMER_FIELDS if field in row})
+                               for row, user in zip(chunk, users)]
+            Customer.objects.using(connection.alias).bulk_create(chunk_customers)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                ids = dict(Customer.objects.using(connection.alias).filter(user__in=users)
+                                                                   .values_list('user_id', 'id'))
+                for customer in chunk_customers:
+                    customer.id = ids[customer.user_id]
+        customers += chunk_customers
+    return customers
@@ -0,0 +1,84 @@
+import json
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+
+# literals, numbers and IN (...) lists, so queries that only differ in their parameters share a shape
+SHAPE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)'), '(...)'),
+]
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    for pattern, replacement in SHAPE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class QueryRecorder:
+    '''
+    Records every query run on any database connection while it is active, with how long it took.
+    Works with DEBUG off, unlike connection.queries.
+    '''
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for alias in connections:
+            self.stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def sql_time(self):
+        return sum(duration for _, _, duration in self.queries)
+
+    def repeated(self, threshold=None):
+        '''
+        Query shapes that ran at least `threshold` times, the signature of an N+1.
+        '''
+        threshold = threshold or getattr(settings, 'STORE_QUERY_REPEAT_THRESHOLD', 3)
+        shapes = Counter(query_shape(sql) for sql, _, _ in self.queries
+                         if not sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS))
+        return {shape: count for shape, count in shapes.items() if count >= threshold}
+
+    def write_log(self, path):
+        '''
+        Appends the queries as JSON lines for ./manage.py advise_indexes to replay.
+        '''
+        with open(path, 'a') as log:
+            for sql, params, duration in self.queries:
+                log.write(json.dumps({'sql': sql, 'params': params, 'ms': round(duration * 1000, 3)}, default=str) + '\n')
+
+    def problems(self, budget=None):
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f'{self.count} queries over a budget of {budget}')
+        for shape, count in self.repeated().items():
+            problems.append(f'{count} queries of the same shape: {shape}')
+        return problems
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+# Read replica routing. The catalogue models are read from a replica in GET, HEAD and OPTIONS requests, everything
+# else, and anything outside a request, stays on the primary. store.middleware.ReplicaRoutingMiddleware decides per
+# request and pins clients that just wrote to the primary.
+
+REPLICATED_MODELS = {'store.product', 'store.collection', 'store.review', 'tags.tag', 'tags.taggeditem'}
+
+routing = ContextVar('store_routing', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'STORE_READ_REPLICAS', [])
+
+
+class Routing:
+    '''
+    Routing of the current request. Reads stay on the primary once anything was written.
+    '''
+    def __init__(self, primary):
+        self.primary = primary
+        self.wrote = False
+        self.replica_reads = False
+
+
+def read_from_replica():
+    # whether the current request read anything from a replica, which may lag behind
+    state = routing.get()
+    return state is not None and state.replica_reads
+
+
+class ReplicaMonitor:
+    '''
+    Keeps the list of replicas no further behind the primary than STORE_REPLICA_MAX_LAG seconds. refresh() measures
+    them, the middleware calls it at most every STORE_REPLICA_LAG_CHECK_SECONDS so the router itself never queries.
+    A replica that can't be reached counts as lagging.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.fresh = []
+
+    def needs_refresh(self):
+        interval = getattr(settings, 'STORE_REPLICA_LAG_CHECK_SECONDS', 5)
+        return self.checked_at is None or time.monotonic() - self.checked_at >= interval
+
+    def refresh(self):
+        # one thread measures, the others keep using the last result meanwhile
+        if not self.lock.acquire(blocking=self.checked_at is None):
+            return
+        try:
+            max_lag = getattr(settings, 'STORE_REPLICA_MAX_LAG', 5)
+            fresh = []
+            for alias in get_replicas():
+                try:
+                    lag = self.get_lag(alias)
+                except DatabaseError:
+                    lag = None
+                if lag is not None and lag <= max_lag:
+                    fresh.append(alias)
+            self.fresh = fresh
+            self.checked_at = time.monotonic()
+        finally:
+            self.lock.release()
+
+    def get_lag(self, alias):
+        '''
+        Seconds the replica is behind, None when it isn't replicating.
+        '''
+        connection = connections[alias]
+        if connection.vendor != 'mysql':
+            # nothing to measure on the SQLite stand-ins
+            connection.ensure_connection()
+            return 0
+        with connection.cursor() as cursor:
+            # MySQL 8.0.22 and later
+            cursor.execute('SHOW REPLICA STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            status = dict(zip([column[0] for column in cursor.description], row))
+        lag = status.get('Seconds_Behind_Source')
+        return None if lag is None else float(lag)
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if state is None or state.primary or model._meta.label_lower not in REPLICATED_MODELS:
+            return None
+        if not replica_monitor.fresh:
+            return None
+        state.replica_reads = True
+        return random.choice(replica_monitor.fresh)
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            state.primary = state.wrote = True
+        # Django would otherwise save an instance read from a replica back to it
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_replicas():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,122 @@
+import re
+from abc import ABC, abstractmethod
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+
+
+FTS_TABLE = 'store_product_fts'
+
+
+class SearchBackend(ABC):
+    '''
+    Inverted index over Product.title and Product.description.
+    search() narrows the queryset to products matching every term, full-text backends annotate a search_rank and
+    order by it, best match first. index() and remove() are called from the Product save/delete signals to keep the
+    index in sync.
+    '''
+    @abstractmethod
+    def search(self, queryset, terms):
+        pass
+
+    def index(self, product):
+        pass
+
+    def remove(self, product):
+        pass
+
+    def reindex(self, product_ids, using='default'):
+        # for bulk writes that skip the Product signals
+        pass
+
+
+class MySQLFullTextBackend(SearchBackend):
+    # MySQL maintains the FULLTEXT index itself on every write, so index() and remove() stay no-ops
+    def search(self, queryset, terms):
+        # boolean mode so every term is required and matches as a prefix while the user is typing
+        query = ' '.join(f'+{term}*' for term in self.clean(terms))
+        if not query:
+            return queryset
+        rank = RawSQL(
+            'MATCH (store_product.title, store_product.description) AGAINST (%s IN BOOLEAN MODE)', (query,))
+        return queryset.annotate(search_rank=rank).filter(search_rank__gt=0).order_by('-search_rank', 'id')
+
+    def clean(self, terms):
+        # drop the boolean mode operators so user input can't change the query
+        return [term for term in (re.sub(r'[+\-<>()~*"@]', '', term) for term in terms) if term]
+
+
+class SQLiteFTSBackend(SearchBackend):
+    # FTS5 shadow table keyed by the product id, filled by migration 0015 and kept current by the signals
+    def search(self, queryset, terms):
+        query = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        if not query:
+            return queryset
+        # joined rather than ranked in a correlated subquery, which would run the whole MATCH again for every
+        # matching row. bm25() is negative, lower is a better match
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = store_product.id'],
+            params=[query],
+            select={'search_rank': f'bm25({FTS_TABLE})'},
+        ).order_by('search_rank', 'id')
+
+    def index(self, product):
+        with connections[product._state.db].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)',
+                [product.pk, product.title, product.description or ''])
+
+    def remove(self, product):
+        with connections[product._state.db].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+
+    def reindex(self, product_ids, using='default'):
+        if not product_ids:
+            return
+        ids = ', '.join(['%s'] * len(product_ids))
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({ids})', list(product_ids))
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description) '
+                f"SELECT id, title, COALESCE(description, '') FROM store_product WHERE id IN ({ids})", list(product_ids))
+
+
+class LikeBackend(SearchBackend):
+    # no inverted index available, every term is an icontains lookup like DRF's SearchFilter does
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        return queryset
+
+
+BACKENDS = {
+    'mysql': MySQLFullTextBackend,
+    'sqlite': SQLiteFTSBackend,
+}
+
+
+def get_search_backend(using='default'):
+    '''
+    STORE_SEARCH_BACKEND can point at a SearchBackend subclass, otherwise the backend is picked from the database vendor.
+    '''
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS.get(connections[using].vendor, LikeBackend)()
+
+
+class ProductSearchFilter(SearchFilter):
+    '''
+    Same ?search= API as SearchFilter, answered from the full-text index and ordered by rank. An explicit ?ordering,
+    and keyset pagination (see store.pagination.ProductPagination), replace the rank order.
+    '''
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_search_backend(queryset.db).search(queryset, terms)
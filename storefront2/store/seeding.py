@@ -0,0 +1,270 @@
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from decimal import Decimal
+from hashlib import blake2b
+from multiprocessing import get_context
+from uuid import UUID
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.db.models import Count, Max
+from likes.models import LikeCount, LikedItem
+from tags.models import Tag, TaggedItem
+from . import pricing
+from .cache import invalidate
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Promotion, Review
+from .search import get_search_backend
+
+
+# Synthetic store data for ./manage.py seed_store and the API benchmarks. The primary key of every generated row
+# is decided up front and every random choice comes from the seed and the position of the row, so chunks can be
+# generated in any order and in any process, and foreign keys point at rows another chunk creates without
+# anything being read back. The rows are written with bulk_create(), which sends no model signals, the per-row
+# work those do (a Customer per user, collection counts, prices, the search index) is done in bulk here instead.
+
+ADJECTIVES = ['red', 'organic', 'spicy', 'frozen', 'smoked', 'sweet', 'fresh', 'aged', 'wild', 'golden']
+NOUNS = ['coffee', 'cheese', 'bread', 'salmon', 'honey', 'pepper', 'olive', 'tea', 'chocolate', 'noodles']
+NAMES = ['Alex', 'Sam', 'Robin', 'Kim', 'Jamie', 'Charlie', 'Noor', 'Ari', 'Yuki', 'Dana']
+
+# tables whose ids are decided up front
+KEYED = {
+    'collection': Collection,
+    'promotion': Promotion,
+    'tag': Tag,
+    'product': Product,
+    'user': get_user_model(),
+    'customer': Customer,
+    'order': Order,
+}
+
+
+class Plan:
+    '''
+    How many rows to generate and the first id of each KEYED table, after the highest existing one.
+    Products, customers, orders and carts are split into chunks of chunk_size rows.
+    '''
+    def __init__(self, seed=0, products=1000, customers=None, orders=None, carts=None, likes=5, password=None,
+                 chunk_size=5000):
+        self.seed = seed
+        self.chunk_size = chunk_size
+        customers = max(products // 10, 1) if customers is None else customers
+        self.counts = {
+            'collection': max(products // 1000, 10),
+            'promotion': max(products // 500, 5),
+            'tag': len(ADJECTIVES + NOUNS),
+            'product': products,
+            'user': customers,
+            'customer': customers,
+            'order': customers * 2 if orders is None else orders,
+            'cart': customers // 2 if carts is None else carts,
+        }
+        self.likes = likes
+        # hashed once, hashing per user would take longer than everything else together
+        self.password = make_password(password)
+        self.start = {}
+
+    def allocate(self):
+        for table, model in KEYED.items():
+            self.start[table] = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def ids(self, table):
+        return range(self.start[table], self.start[table] + self.counts[table])
+
+    def chunk(self, table, index):
+        # the positions of the rows of one chunk
+        return range(index * self.chunk_size, min((index + 1) * self.chunk_size, self.counts[table]))
+
+    def chunks(self, table):
+        return -(-self.counts[table] // self.chunk_size)
+
+    def random(self, table, index):
+        return random.Random(f'{self.seed}:{table}:{index}')
+
+    def pick(self, rng, table):
+        # the id of a random row of the table
+        return self.start[table] + rng.randrange(self.counts[table])
+
+    def unit_price(self, position):
+        # a function of the product alone, order items copy it from products another chunk generates
+        digest = blake2b(f'{self.seed}:price:{position}'.encode(), digest_size=8).digest()
+        return Decimal(int.from_bytes(digest, 'big') % 19900 + 100) / 100
+
+    def uuid(self, table, position):
+        # UUID keys aren't allocated after the existing rows like ids, they come from where this run's ids start so
+        # another run with the same seed doesn't make the same ones
+        offsets = ':'.join(str(self.start[table]) for table in KEYED)
+        digest = blake2b(f'{self.seed}:{table}:{offsets}:{position}'.encode(), digest_size=16).digest()
+        return UUID(bytes=digest, version=4)
+
+    def discount(self, promotion_id):
+        return [0.05, 0.1, 0.2, 0.5][(promotion_id - self.start['promotion']) % 4]
+
+
+def seed_catalogue(plan):
+    Collection.objects.bulk_create([Collection(id=id, title=f'Collection {id}') for id in plan.ids('collection')])
+    Promotion.objects.bulk_create([Promotion(id=id, description=f'Promotion {id}', discount=plan.discount(id))
+                                   for id in plan.ids('promotion')])
+    Tag.objects.bulk_create([Tag(id=id, label=label) for id, label in zip(plan.ids('tag'), ADJECTIVES + NOUNS)])
+    return Counter(collection=plan.counts['collection'], promotion=plan.counts['promotion'], tag=plan.counts['tag'])
+
+
+def seed_products(plan, index):
+    '''
+    A chunk of products with their promotions, tags and reviews, and the products in the search index.
+    '''
+    rng = plan.random('product', index)
+    product_type = ContentType.objects.get_for_model(Product)
+    products, promotions, tagged_items, reviews = [], [], [], []
+    for position in plan.chunk('product', index):
+        id = plan.start['product'] + position
+        words = [rng.choice(ADJECTIVES), rng.choice(NOUNS)]
+        # a fifth of the products are on promotion
+        promotion_ids = rng.sample(plan.ids('promotion'), rng.randint(1, 2)) if rng.random() < 0.2 else []
+        unit_price = plan.unit_price(position)
+        products.append(Product(
+            id=id, title=f'{" ".join(words).capitalize()} {id}', slug=f'{"-".join(words)}-{id}',
+            description=' '.join(rng.choice(ADJECTIVES + NOUNS) for _ in range(12)), unit_price=unit_price,
+            inventory=rng.randint(0, 1000), collection_id=plan.pick(rng, 'collection'),
+            price_with_tax=pricing.price_with_tax(
+                unit_price, max(map(plan.discount, promotion_ids)) if promotion_ids else None)))
+        promotions += [Product.promotions.through(product_id=id, promotion_id=promotion_id)
+                       for promotion_id in promotion_ids]
+        tagged_items += [TaggedItem(tag_id=tag_id, content_type_id=product_type.id, object_id=id)
+                         for tag_id in rng.sample(plan.ids('tag'), rng.randint(0, 3))]
+        reviews += [Review(product_id=id, name=rng.choice(NAMES), description=f'{rng.choice(ADJECTIVES)} and good')
+                    for _ in range(rng.randint(0, 3))]
+
+    with transaction.atomic():
+        Product.objects.bulk_create(products)
+        Product.promotions.through.objects.bulk_create(promotions)
+        TaggedItem.objects.bulk_create(tagged_items)
+        Review.objects.bulk_create(reviews)
+        search = get_search_backend()
+        for start in range(0, len(products), 1000):
+            search.reindex([product.id for product in products[start:start + 1000]])
+    return Counter(product=len(products), promotion_link=len(promotions), tagged_item=len(tagged_items),
+                   review=len(reviews))
+
+
+def seed_customers(plan, index):
+    # users and their customers, which the post_save signal would otherwise create one query at a time
+    rng = plan.random('customer', index)
+    users, customers = [], []
+    for position in plan.chunk('customer', index):
+        user_id = plan.start['user'] + position
+        users.append(get_user_model()(
+            id=user_id, username=f'user{user_id}', email=f'user{user_id}@example.com', password=plan.password,
+            first_name=rng.choice(NAMES), last_name=rng.choice(NAMES)))
+        customers.append(Customer(
+            id=plan.start['customer'] + position, user_id=user_id, phone=f'555-{rng.randrange(10 ** 7):07d}',
+            birth_date=date(1950, 1, 1) + timedelta(days=rng.randrange(20000)),
+            membership=rng.choice(Customer.MEMBERSHIP_CHOICES)[0]))
+
+    with transaction.atomic():
+        get_user_model().objects.bulk_create(users)
+        Customer.objects.bulk_create(customers)
+    return Counter(user=len(users), customer=len(customers))
+
+
+def seed_orders(plan, index):
+    rng = plan.random('order', index)
+    orders, items = [], []
+    for position in plan.chunk('order', index):
+        id = plan.start['order'] + position
+        orders.append(Order(id=id, customer_id=plan.pick(rng, 'customer'),
+                            payment_status=rng.choice(Order.PAYMENT_STATUS_CHOICES)[0]))
+        products = rng.sample(range(plan.counts['product']), min(rng.randint(1, 4), plan.counts['product']))
+        for product_position in products:
+            items.append(OrderItem(order_id=id, product_id=plan.start['product'] + product_position,
+                                   quantity=rng.randint(1, 3), unit_price=plan.unit_price(product_position)))
+
+    with transaction.atomic():
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create(items)
+    return Counter(order=len(orders), order_item=len(items))
+
+
+def seed_carts(plan, index):
+    rng = plan.random('cart', index)
+    carts, items = [], []
+    for position in plan.chunk('cart', index):
+        cart = Cart(id=plan.uuid('cart', position))
+        carts.append(cart)
+        items += [CartItem(cart_id=cart.id, product_id=product_id, quantity=rng.randint(1, 5))
+                  for product_id in rng.sample(plan.ids('product'), min(rng.randint(1, 3), plan.counts['product']))]
+
+    with transaction.atomic():
+        Cart.objects.bulk_create(carts)
+        CartItem.objects.bulk_create(items)
+    return Counter(cart=len(carts), cart_item=len(items))
+
+
+def seed_likes(plan, index):
+    # products liked by a chunk of the customers' users
+    rng = plan.random('like', index)
+    product_type = ContentType.objects.get_for_model(Product)
+    likes = [LikedItem(user_id=plan.start['user'] + position, content_type_id=product_type.id, object_id=product_id)
+             for position in plan.chunk('customer', index)
+             for product_id in rng.sample(plan.ids('product'), min(plan.likes, plan.counts['product']))]
+    LikedItem.objects.bulk_create(likes)
+    return Counter(like=len(likes))
+
+
+# chunks of the same stage only point at rows of earlier stages, they can be written in parallel
+STAGES = [
+    [('product', seed_products), ('customer', seed_customers)],
+    [('order', seed_orders), ('cart', seed_carts), ('customer', seed_likes)],
+]
+
+
+def count_likes(plan):
+    # LikeCount rows of the new products, which likes.buffer would otherwise keep
+    product_type = ContentType.objects.get_for_model(Product)
+    connection = connections[router.db_for_write(LikeCount)]
+    unique_fields = ['content_type', 'object_id'] if connection.features.supports_update_conflicts_with_target else None
+    ids = plan.ids('product')
+    for start in range(ids.start, ids.stop, plan.chunk_size):
+        counts = LikedItem.objects.filter(content_type=product_type, object_id__gte=start,
+                                          object_id__lt=min(start + plan.chunk_size, ids.stop)) \
+                                  .values('object_id').annotate(count=Count('id')).values_list('object_id', 'count')
+        LikeCount.objects.bulk_create(
+            [LikeCount(content_type=product_type, object_id=object_id, count=count) for object_id, count in counts],
+            update_conflicts=True, unique_fields=unique_fields, update_fields=['count'])
+
+
+def seed(plan, processes=1, progress=None):
+    '''
+    Generates everything in the plan and returns how many rows of each kind were written. With more than one
+    process the chunks of a stage are spread over a pool of spawned workers, which connect to the databases
+    in settings themselves. progress(name, counts) is called after every chunk.
+    '''
+    plan.allocate()
+    with transaction.atomic():
+        counts = seed_catalogue(plan)
+
+    for stage in STAGES:
+        tasks = [(function, index) for table, function in stage for index in range(plan.chunks(table))]
+        if processes > 1:
+            # spawned rather than forked workers, which would share the parent's connections. They import the
+            # project from scratch, django.setup() has to run before this module can be imported
+            connections.close_all()
+            with ProcessPoolExecutor(processes, mp_context=get_context('spawn'), initializer=django.setup) as pool:
+                futures = {pool.submit(function, plan, index): function for function, index in tasks}
+                for future in as_completed(futures):
+                    counts.update(future.result())
+                    if progress:
+                        progress(futures[future].__name__, counts)
+        else:
+            for function, index in tasks:
+                counts.update(function(plan, index))
+                if progress:
+                    progress(function.__name__, counts)
+
+    count_likes(plan)
+    Collection.objects.recount_products(plan.ids('collection'))
+    invalidate('products', 'collections')
+    return counts
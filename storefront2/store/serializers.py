@@ -1,7 +1,16 @@
+from collections import defaultdict
 from rest_framework import serializers
-from django.db import transaction
-from decimal import Decimal
-from . import models
+from django.contrib.auth import get_user_model
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from tags.serializers import TaggedListSerializer, TagsField
+from . import inventory, models, pricing, provisioning
+from .cache import invalidate
+from .search import get_search_backend
 from .signals import order_created
 
 
@@ -13,16 +22,170 @@ class CollectionSerializer(serializers.ModelSerializer):
     products_count = serializers.IntegerField(read_only=True)
 
 
+class BatchPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    # resolves the pk from the objects a list serializer loaded for the whole batch instead of one query per row
+    def to_internal_value(self, data):
+        loaded = self.context.get('batch_objects', {}).get(self.queryset.model)
+        if loaded is None:
+            return super().to_internal_value(data)
+        try:
+            return loaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+def to_pks(values):
+    pks = set()
+    for value in values:
+        try:
+            pks.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return pks
+
+
+class BatchListSerializer(serializers.ListSerializer):
+    '''
+    Validates a batch row by row, after prepare() has loaded whatever the rows refer to for the whole batch at once,
+    and validate_row() checks each valid row against that. With partial_rows in the context invalid rows are skipped
+    and listed in row_errors instead of failing the batch.
+    '''
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+
+        self.prepare([row for row in data if isinstance(row, dict)])
+        validated, errors = [], []
+        for row in data:
+            try:
+                attrs = self.validate_row(row, self.child.run_validation(row))
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+            else:
+                validated.append(attrs)
+                errors.append({})
+
+        self.row_errors = [{'index': index, 'errors': error} for index, error in enumerate(errors) if error]
+        if self.row_errors and not self.context.get('partial_rows'):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def prepare(self, rows):
+        pass
+
+    def validate_row(self, row, attrs):
+        return attrs
+
+
+class ProductListSerializer(BatchListSerializer, TaggedListSerializer):
+    '''
+    Batch writes for ProductViewSet.batch. The collections (and for updates the products) of the whole batch are
+    loaded in one query each and the rows are written with bulk_create/bulk_update in chunks inside one transaction.
+    '''
+    batch_size = 500
+
+    def prepare(self, rows):
+        self.context['batch_objects'] = {
+            models.Collection: models.Collection.objects.in_bulk(to_pks(row.get('collection') for row in rows))
+        }
+        if self.instance is not None:
+            # only checked for existence here, update() reads the rows again under a lock
+            self.product_ids = set(self.instance.filter(pk__in=to_pks(row.get('id') for row in rows))
+                                                .values_list('pk', flat=True))
+
+    def validate_row(self, row, attrs):
+        if self.instance is not None:
+            attrs['id'] = self.validate_id(row)
+        return attrs
+
+    def validate_id(self, row):
+        try:
+            pk = int(row['id'])
+        except (KeyError, TypeError, ValueError):
+            pk = None
+        if pk not in self.product_ids:
+            raise serializers.ValidationError({'id': ['Expected the id of an existing product.']})
+        return pk
+
+    def create(self, validated_data):
+        products = [models.Product(**attrs) for attrs in validated_data]
+        for product in products:
+            # no promotions yet
+            product.price_with_tax = pricing.price_with_tax(product.unit_price)
+        with transaction.atomic():
+            models.Product.objects.bulk_create(products, batch_size=self.batch_size)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # MySQL doesn't hand back the ids of bulk_create, the newest products with these slugs are the ones
+                # just written, in the order they were inserted
+                ids = defaultdict(list)
+                for slug, id in models.Product.objects.filter(slug__in={product.slug for product in products}) \
+                                                      .order_by('id').values_list('slug', 'id'):
+                    ids[slug].append(id)
+                for product in reversed(products):
+                    product.id = ids[product.slug].pop()
+            self.written(products, {product.collection_id for product in products})
+        return products
+
+    def update(self, instance, validated_data):
+        now = timezone.now()
+        changes = defaultdict(dict)
+        for attrs in validated_data:
+            changes[attrs.pop('id')].update(attrs)
+
+        with transaction.atomic():
+            # the products loaded for validation may be stale by now, and every row only writes back the fields it
+            # changes, a checkout taking stock from a product whose price is being updated keeps its inventory
+            products = models.Product.objects.select_for_update().order_by('pk').in_bulk(changes)
+            groups, collection_ids = defaultdict(list), set()
+            for pk, attrs in changes.items():
+                product = products.get(pk)
+                if product is None:
+                    # deleted since
+                    continue
+                collection_ids.add(product.collection_id)
+                for field, value in attrs.items():
+                    setattr(product, field, value)
+                # bulk_update() doesn't apply auto_now
+                product.last_update = now
+                collection_ids.add(product.collection_id)
+                groups[frozenset(attrs) | {'last_update'}].append(product)
+
+            repriced = [product.pk for fields, group in groups.items() if 'unit_price' in fields for product in group]
+            discounts = pricing.best_discounts(repriced) if repriced else {}
+            for fields, group in groups.items():
+                if 'unit_price' in fields:
+                    for product in group:
+                        product.price_with_tax = pricing.price_with_tax(product.unit_price, discounts.get(product.pk))
+                    fields |= {'price_with_tax'}
+                models.Product.objects.bulk_update(group, sorted(fields), batch_size=self.batch_size)
+            updated = [product for group in groups.values() for product in group]
+            self.written(updated, collection_ids)
+        return updated
+
+    def written(self, products, collection_ids):
+        # bulk writes skip the Product signals, so catch up on what they maintain
+        models.Collection.objects.recount_products(collection_ids)
+        get_search_backend().reindex([product.pk for product in products if product.pk is not None])
+        invalidate('products', 'collections')
+
+
 class ProductSerializer(serializers.ModelSerializer):
+    serializer_related_field = BatchPrimaryKeyRelatedField
+
     class Meta:
         model = models.Product
-        fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'price_with_tax', 'collection']
+        fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'price_with_tax', 'collection', 'tags']
+        list_serializer_class = ProductListSerializer
 
-    price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
+    tags = TagsField()
 
-    
-    def calculate_tax(self, product: models.Product):
-        return product.unit_price * Decimal(1.10)
+    def create(self, validated_data):
+        product = super().create(validated_data)
+        # nothing can have tagged it yet, TagsField needn't look
+        product.prefetched_tags = []
+        return product
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -43,15 +206,13 @@ class SimpleProductSerializer(serializers.ModelSerializer):
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer(read_only=True)
-    total_price = serializers.SerializerMethodField("calculate_price")
+    # annotated by CartItem.objects.with_total_price()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     
     class Meta:
         model = models.CartItem
         fields = ["id", "product", "quantity", "total_price"]
 
-    def calculate_price(self, cart_item: models.CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
-
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -59,11 +220,32 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         fields = ["quantity"]
 
 
+class AddCartItemListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        # one query for the whole batch instead of one exists() per item
+        product_ids = {item["product_id"] for item in attrs}
+        found = set(models.Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True))
+        missing = product_ids - found
+        if missing:
+            raise serializers.ValidationError(f"No products with the given ids: {sorted(missing)}")
+        return attrs
+
+    def save(self, **kwargs):
+        # merge repeated products so the batch is a single upsert
+        quantities = {}
+        for item in self.validated_data:
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+
+        self.instance = list(models.CartItem.objects.add_items(self.context["cart_id"], quantities))
+        return self.instance
+
+
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
     def validate_product_id(self, value):
-        if not models.Product.objects.filter(pk=value).exists():
+        # batches check all their products at once in AddCartItemListSerializer.validate
+        if self.parent is None and not models.Product.objects.filter(pk=value).exists():
             raise serializers.ValidationError("No product with that given id")
         return value
 
@@ -72,23 +254,14 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         quantity = self.validated_data["quantity"]
         cart_id = self.context["cart_id"]
 
-        #  same logic as genericviewset save method. Assign instance to new cart item
-        try: 
-            # update existing cart_id
-            cart_item = models.CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        
-        except models.CartItem.DoesNotExist:
-            # If no cartitem is found, this logic will create one
-            self.instance = models.CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-
+        # creates the cart item or adds to its quantity in one statement, safe against concurrent adds
+        self.instance = models.CartItem.objects.add_items(cart_id, {product_id: quantity}).get()
         return self.instance
 
     class Meta:
         model = models.CartItem
         fields = ["id", "product_id", "quantity"]
+        list_serializer_class = AddCartItemListSerializer
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -102,7 +275,8 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', "items", "total_price"]
 
     def get_total_price(self, cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()]) 
+        # annotated by Cart.objects.with_total_price(), a cart that was just created has no items yet
+        return getattr(cart, 'total_price', None) or 0
     
 class CustomerSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
@@ -112,6 +286,66 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ["id", "user_id", "phone", "birth_date", "membership"]
 
 
+class ProvisionCustomerListSerializer(BatchListSerializer):
+    '''
+    Batch sign-ups for CustomerViewSet.batch and ./manage.py provision_customers. The usernames and emails of the
+    whole batch already taken are loaded in one query each, and taken again by an earlier row of the batch count too.
+    They are compared in lower case, as MySQL's collations compare them, a row differing only in case would otherwise
+    fail its whole chunk with an IntegrityError.
+    '''
+    unique_fields = ['username', 'email']
+
+    def prepare(self, rows):
+        users = get_user_model().objects.all()
+        self.taken = {}
+        for field in self.unique_fields:
+            values = {str(row[field]).lower() for row in rows if row.get(field)}
+            self.taken[field] = set(users.annotate(folded=Lower(field)).filter(folded__in=values)
+                                         .values_list('folded', flat=True))
+
+    def validate_row(self, row, attrs):
+        used = {field: [f'A user with that {field} already exists.']
+                for field in self.unique_fields if attrs[field].lower() in self.taken[field]}
+        if used:
+            raise serializers.ValidationError(used)
+        for field in self.unique_fields:
+            self.taken[field].add(attrs[field].lower())
+        return attrs
+
+    def create(self, validated_data):
+        return provisioning.provision(validated_data, processes=self.context.get('processes'))
+
+
+class ProvisionCustomerSerializer(serializers.Serializer):
+    # a user and its customer in one row, without a password the user can't log in until it is set
+    id = serializers.IntegerField(read_only=True)
+    user_id = serializers.IntegerField(read_only=True)
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField()
+    password = serializers.CharField(write_only=True, required=False, allow_null=True, trim_whitespace=False)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    phone = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    birth_date = serializers.DateField(required=False, allow_null=True)
+    membership = serializers.ChoiceField(models.Customer.MEMBERSHIP_CHOICES, required=False)
+
+    class Meta:
+        list_serializer_class = ProvisionCustomerListSerializer
+
+    def validate(self, attrs):
+        if attrs.get('password') is not None:
+            user = get_user_model()(**{field: attrs[field] for field in provisioning.USER_FIELDS if field in attrs})
+            try:
+                validate_password(attrs['password'], user)
+            except DjangoValidationError as error:
+                raise serializers.ValidationError({'password': list(error.messages)})
+        return attrs
+
+    def to_representation(self, customer):
+        return {'id': customer.id, 'user_id': customer.user_id, 'username': customer.user.username,
+                'email': customer.user.email, 'membership': customer.membership}
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     class Meta:
@@ -134,38 +368,43 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not models.Cart.objects.filter(pk=cart_id).exists():
+        # a LEFT JOIN of the cart with its items: no rows means no cart, a row of NULLs means an empty cart
+        rows = list(models.Cart.objects.filter(pk=cart_id).values_list(
+            'items__product_id', 'items__quantity', 'items__product__unit_price'))
+        if not rows:
             raise serializers.ValidationError('No cart with the given id was found')
-        if models.CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if rows[0][0] is None:
             raise serializers.ValidationError("cart is empty")
+        self.cart_rows = rows
         return cart_id
 
-    ''' Creates an order, validates it against the cart id. Returns information storing it into variable order items which uses list comprehension.\
-    delete cart afterwards 
+    ''' Creates an order from the cart rows loaded by validate_cart_id, takes the ordered quantities off the product inventory\
+    and deletes the cart afterwards. Runs the same number of queries whatever the size of the cart.
     '''
     def save(self, **kwargs):
         # wrapping up function in transaction.atomic. Makes it so either all the code gets executed or if something goes wrong all changes get rolled back.
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
-            # Tuple unpacking
-            customer = models.Customer.objects.get(user_id=self.context['user_id'])
-            order = models.Order.objects.create(customer=customer)
-        
-            cart_items = models.CartItem.objects.filter(
-                cart_id=cart_id
-            )
+            customer_id = models.Customer.objects.values_list('id', flat=True).get(user_id=self.context['user_id'])
+            order = models.Order.objects.create(customer_id=customer_id)
 
             order_items = [
                 models.OrderItem(
                         order=order,
-                        product = item.product,
-                        unit_price= item.quantity,
-                        quantity=item.quantity
-            ) for item in cart_items]
-
+                        product_id=product_id,
+                        unit_price=unit_price,
+                        quantity=quantity
+            ) for product_id, quantity, unit_price in self.cart_rows]
             models.OrderItem.objects.bulk_create(order_items)
+
+            # takes the stock or rejects the whole order, see store.inventory
+            try:
+                inventory.checkout_cart(cart_id, {item.product_id: item.quantity for item in order_items})
+            except inventory.OutOfStock as error:
+                raise serializers.ValidationError({'cart_id': [str(error)]})
+
             models.Cart.objects.filter(pk=cart_id).delete()
 
-            order_created
+            order_created.send_robust(self.__class__, order=order)
 
-            return order
\ No newline at end of file
+            return order
@@ -1,9 +1,162 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models import Case, F, Max, PositiveIntegerField, When
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
-from ..models import Customer
+from .. import pricing
+from ..cache import invalidate
+from ..models import Customer, Product, Collection, Promotion
+from ..search import get_search_backend
+from tags.models import Tag, TaggedItem
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
         Customer.objects.create(user=kwargs['instance'])
+
+
+def search_text(instance):
+    # the indexed fields, None for a deferred one that was never loaded
+    return instance.__dict__.get('title'), instance.__dict__.get('description')
+
+
+@receiver(post_init, sender=Product)
+def remember_saved_product(sender, **kwargs):
+    # read from __dict__ so a deferred field doesn't cost a query
+    instance = kwargs['instance']
+    instance._saved_collection_id = instance.__dict__.get('collection_id')
+    instance._saved_unit_price = instance.__dict__.get('unit_price')
+    instance._saved_search_text = search_text(instance)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, **kwargs):
+    instance = kwargs['instance']
+    old_id, new_id = instance._saved_collection_id, instance.collection_id
+    collections = Collection.objects.using(kwargs['using'])
+    if kwargs['created']:
+        collections.filter(pk=new_id).update(products_count=F('products_count') + 1)
+    elif old_id is not None and old_id != new_id:
+        # moved between collections, both counters in one UPDATE
+        collections.filter(pk__in=[old_id, new_id]).update(products_count=Case(
+            When(pk=new_id, then=F('products_count') + 1),
+            When(products_count__gt=0, then=F('products_count') - 1),
+            default=F('products_count'),
+            output_field=PositiveIntegerField(),
+        ))
+    instance._saved_collection_id = new_id
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, **kwargs):
+    Collection.objects.using(kwargs['using']) \
+        .filter(pk=kwargs['instance'].collection_id, products_count__gt=0) \
+        .update(products_count=F('products_count') - 1)
+
+
+def unit_price_changed(instance, update_fields):
+    if update_fields is not None:
+        return 'unit_price' in update_fields
+    return instance._saved_unit_price is None or instance.unit_price != instance._saved_unit_price
+
+
+@receiver(pre_save, sender=Product)
+def price_product(sender, **kwargs):
+    instance = kwargs['instance']
+    if instance._state.adding:
+        # a new product has no promotions yet
+        instance.price_with_tax = pricing.price_with_tax(instance.unit_price)
+    elif unit_price_changed(instance, kwargs['update_fields']):
+        # promotion changes reprice through refresh_prices(), the loaded price only goes stale with the unit price
+        discount = instance.promotions.aggregate(discount=Max('discount'))['discount']
+        instance.price_with_tax = pricing.price_with_tax(instance.unit_price, discount)
+
+
+@receiver(post_save, sender=Product)
+def save_product_price(sender, **kwargs):
+    # save(update_fields=[...]) only writes the listed fields, so the price set in pre_save needs its own write
+    instance, update_fields = kwargs['instance'], kwargs['update_fields']
+    if update_fields and 'unit_price' in update_fields and 'price_with_tax' not in update_fields:
+        pricing.refresh_prices([instance.pk], using=kwargs['using'])
+    instance._saved_unit_price = instance.unit_price
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, **kwargs):
+    instance, update_fields = kwargs['instance'], kwargs['update_fields']
+    if update_fields is not None and not {'title', 'description'} & set(update_fields):
+        return
+    text = search_text(instance)
+    if kwargs['created'] or text != instance._saved_search_text:
+        get_search_backend(kwargs['using']).index(instance)
+        instance._saved_search_text = text
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, **kwargs):
+    get_search_backend(kwargs['using']).remove(kwargs['instance'])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, **kwargs):
+    # collections embed products_count, so they go stale along with the products
+    invalidate('products', 'collections')
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_collection_cache(sender, **kwargs):
+    invalidate('collections')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_tag_cache(sender, **kwargs):
+    # products embed their tag labels
+    invalidate('products')
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_promotion_cache(sender, **kwargs):
+    invalidate('products')
+
+
+@receiver(post_save, sender=Promotion)
+def reprice_promotion_products(sender, **kwargs):
+    if not kwargs['created']:
+        instance = kwargs['instance']
+        pricing.refresh_prices(instance.product_set.values_list('pk', flat=True), using=kwargs['using'])
+
+
+@receiver(pre_delete, sender=Promotion)
+def remember_promotion_products(sender, **kwargs):
+    # the links are deleted before post_delete runs
+    instance = kwargs['instance']
+    instance._product_ids = list(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Promotion)
+def reprice_deleted_promotion_products(sender, **kwargs):
+    pricing.refresh_prices(kwargs['instance']._product_ids, using=kwargs['using'])
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def reprice_promoted_products(sender, **kwargs):
+    action, instance = kwargs['action'], kwargs['instance']
+    if action == 'pre_clear' and kwargs['reverse']:
+        # promotion.product_set.clear() doesn't say which products it unlinked
+        instance._product_ids = list(instance.product_set.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not kwargs['reverse']:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = instance._product_ids
+    else:
+        product_ids = kwargs['pk_set']
+    pricing.refresh_prices(product_ids, using=kwargs['using'])
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from .queries import QueryBudgetExceeded, QueryRecorder
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    # any request in the test suite that goes over its view's query_budget or runs an N+1 fails the test
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.STORE_QUERY_BUDGET_STRICT = True
+        # reads go to the primary unless a test turns the replicas on
+        settings.STORE_READ_REPLICAS = []
+
+
+@contextmanager
+def query_budget(budget=None):
+    '''
+    Fails the block if it runs more than `budget` queries or repeats a query shape:
+
+        with query_budget(3):
+            serializer.save()
+    '''
+    with QueryRecorder() as recorder:
+        yield recorder
+    problems = recorder.problems(budget)
+    if problems:
+        raise QueryBudgetExceeded('; '.join(problems))
@@ -1,3 +1,1203 @@
-from django.test import TestCase
+import json
+import os
+import pstats
+import sqlite3
+import threading
+import time
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+from types import ModuleType
+from unittest import skipUnless
+from unittest.mock import patch
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.admin import AdminSite
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, is_password_usable
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+from django.urls import include, path
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from likes.models import LikeCount, LikedItem
+from tags.models import Tag, TaggedItem
+from . import inventory, pricing, provisioning
+from .admin import ProductAdmin
+from .benchmarks import API_SCENARIOS, compare, run_api, seed_dataset
+from .db.pool import ConnectionPool, PoolTimeout
+from .management.commands.advise_indexes import explain_sqlite
+from .metrics import Histogram, registry
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Promotion, Reservation, Review
+from .parsers import FastJSONParser
+from .queries import QueryBudgetExceeded
+from .renderers import FastJSONRenderer
+from .routers import ReplicaMonitor, replica_monitor
+from .search import FTS_TABLE, LikeBackend, SQLiteFTSBackend
+from .seeding import Plan, seed
+from .serializers import CartSerializer, CollectionSerializer, CreateOrderSerializer, OrderSerializer, ProductSerializer, \
+    ProductListSerializer
+from .testing import query_budget
+from .urls import get_urlpatterns
+from .values import CartValues, CollectionValues, OrderValues, ProductValues
+from .views import CartViewSet, CollectionViewSet, OrderViewSet, ProductViewSet
 
-# Create your tests here.
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    ''' More buyers than stock check out at the same time. Exactly the stock gets sold and inventory never goes negative.
+    '''
+    buyers = 20
+    stock = 7
+
+    def setUp(self):
+        collection = Collection.objects.create(title='Flash sale')
+        self.hot = Product.objects.create(title='Hot', slug='hot', unit_price=10, inventory=self.stock, collection=collection)
+        self.other = Product.objects.create(title='Other', slug='other', unit_price=5, inventory=1000, collection=collection)
+
+        self.checkouts = []
+        for i in range(self.buyers):
+            user = get_user_model().objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com')
+            cart = Cart.objects.create()
+            # half the carts list the products the other way round, the locks must still be taken in the same order
+            products = [self.hot, self.other] if i % 2 else [self.other, self.hot]
+            for product in products:
+                CartItem.objects.create(cart=cart, product=product, quantity=1)
+            self.checkouts.append((user.id, cart.id))
+
+    def checkout(self, user_id, cart_id):
+        try:
+            for _ in range(100):
+                try:
+                    serializer = CreateOrderSerializer(data={'cart_id': cart_id}, context={'user_id': user_id})
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                    return True
+                except serializers.ValidationError:
+                    return False
+                except OperationalError:
+                    # deadlock victim or a locked SQLite file, the transaction was rolled back so try again
+                    time.sleep(0.01)
+            raise AssertionError('checkout kept failing')
+        finally:
+            connection.close()
+
+    def test_parallel_checkouts_never_oversell(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda args: self.checkout(*args), self.checkouts))
+
+        self.hot.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(results.count(True), self.stock)
+        self.assertEqual(self.hot.inventory, 0)
+        self.assertEqual(self.other.inventory, 1000 - self.stock)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(OrderItem.objects.filter(product=self.hot).count(), self.stock)
+
+
+class ReservationTest(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(title='Product', slug='product', unit_price=10, inventory=5, collection=collection)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=3)
+
+    def test_expired_reservation_returns_stock(self):
+        inventory.reserve_cart(self.cart.id)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 2)
+
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(inventory.release_expired(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 5)
+
+    def test_checkout_locks_every_product_before_writing(self):
+        other = Product.objects.create(title='Other', slug='other', unit_price=10, inventory=5,
+                                       collection=self.product.collection)
+        CartItem.objects.create(cart=self.cart, product=other, quantity=1)
+        inventory.reserve_cart(self.cart.id)
+        # one product's stock goes back, the other's is taken
+        with CaptureQueriesContext(connection) as queries:
+            inventory.checkout_cart(self.cart.id, {self.product.id: 1, other.id: 3})
+        statements = [query['sql'] for query in queries]
+        locks = [index for index, sql in enumerate(statements) if sql.startswith('SELECT "store_product"."id"')]
+        writes = [index for index, sql in enumerate(statements) if sql.startswith('UPDATE "store_product"')]
+        self.assertEqual(len(locks), 1)
+        self.assertEqual(len(writes), 2)
+        self.assertLess(locks[0], writes[0])
+        self.assertIn('ORDER BY "store_product"."id"', statements[locks[0]])
+        self.assertIn('ORDER BY "store_reservation"."id"', statements[0])
+        self.assertEqual(list(Product.objects.filter(pk__in=[self.product.id, other.id])
+                                             .order_by('pk').values_list('inventory', flat=True)), [4, 2])
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_reserving_more_than_the_stock_is_rejected(self):
+        CartItem.objects.filter(cart=self.cart).update(quantity=6)
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve_cart(self.cart.id)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 5)
+        self.assertFalse(Reservation.objects.exists())
+
+
+class OrderListQueriesTest(TestCase):
+    ''' Listing orders costs the same number of queries however many orders and items there are.
+    '''
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='customer', email='customer@example.com')
+        self.customer = Customer.objects.get(user=self.user)
+        collection = Collection.objects.create(title='Collection')
+        self.products = [
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', unit_price=10, inventory=10, collection=collection)
+            for i in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_orders(self, orders, items):
+        for _ in range(orders):
+            order = Order.objects.create(customer=self.customer)
+            for product in self.products[:items]:
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.unit_price)
+
+    def test_order_list_query_count_is_constant(self):
+        # count, page of orders, items with their products
+        for orders, items in [(1, 1), (5, 5)]:
+            self.place_orders(orders, items)
+            with self.assertNumQueries(3):
+                response = self.client.get('/store/orders/')
+            self.assertEqual(response.status_code, 200)
+
+    def test_customers_only_see_their_orders(self):
+        self.place_orders(2, 2)
+        other = get_user_model().objects.create_user(username='other', email='other@example.com')
+        Order.objects.create(customer=Customer.objects.get(user=other))
+
+        response = self.client.get('/store/orders/')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results'][0]['items']), 2)
+
+
+class CheckoutQueriesTest(TestCase):
+    ''' Checking out costs the same number of queries however many items the cart has, within OrderViewSet's budget.
+    '''
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='customer', email='customer@example.com')
+        collection = Collection.objects.create(title='Collection')
+        self.products = [
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', unit_price=10, inventory=10,
+                                   collection=collection)
+            for i in range(5)
+        ]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+
+    def cart(self, items):
+        cart = Cart.objects.create()
+        for product in self.products[:items]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        return cart
+
+    def checkout(self, cart, items):
+        with self.settings(STORE_QUERY_BUDGET_STRICT=True):
+            response = self.client.post('/store/orders/', {'cart_id': cart.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), items)
+        return response
+
+    def test_query_count_is_constant(self):
+        small, large = self.cart(1), self.cart(5)
+        with CaptureQueriesContext(connection) as queries:
+            self.checkout(small, 1)
+        with self.assertNumQueries(len(queries)):
+            self.checkout(large, 5)
+
+    def test_the_worst_case_is_the_budget(self):
+        # stock to give back on one reserved product and to take on another
+        cart = self.cart(2)
+        inventory.reserve_cart(cart.id)
+        CartItem.objects.filter(cart=cart, product=self.products[0]).update(quantity=1)
+        CartItem.objects.filter(cart=cart, product=self.products[1]).update(quantity=3)
+        response = self.checkout(cart, 2)
+        self.assertEqual(response.wsgi_request.query_recorder.count, OrderViewSet.query_budget['create'])
+        self.assertEqual(list(Product.objects.filter(pk__in=[self.products[0].pk, self.products[1].pk])
+                                             .order_by('pk').values_list('inventory', flat=True)), [9, 7])
+
+
+class CartItemUpsertTest(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = [Product.objects.create(title=f'Product {index}', slug=f'product-{index}', unit_price=10,
+                                                inventory=5, collection=collection) for index in range(5)]
+        self.cart = Cart.objects.create()
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def test_adding_a_product_again_sums_the_quantities(self):
+        first, second = self.products[:2]
+        CartItem.objects.add_items(self.cart.id, {first.id: 2})
+        items = CartItem.objects.add_items(self.cart.id, {first.id: 3, second.id: 1})
+        self.assertEqual({item.product_id: item.quantity for item in items}, {first.id: 5, second.id: 1})
+        self.assertEqual(self.quantities(), {first.id: 5, second.id: 1})
+
+    @override_settings(STORE_MAX_CART_QUANTITY=10)
+    def test_sums_are_capped(self):
+        first, second = self.products[:2]
+        CartItem.objects.add_items(self.cart.id, {first.id: 8})
+        CartItem.objects.add_items(self.cart.id, {first.id: 5, second.id: 50})
+        self.assertEqual(self.quantities(), {first.id: 10, second.id: 10})
+
+    def test_large_batches_are_split(self):
+        Product.objects.bulk_create([Product(title=f'Bulk {index}', slug='bulk', unit_price=10, inventory=5,
+                                             collection=self.products[0].collection) for index in range(296)])
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        self.assertEqual(len(product_ids), 301)
+        with CaptureQueriesContext(connection) as queries:
+            CartItem.objects.add_items(self.cart.id, {product_id: 1 for product_id in product_ids})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 2)
+        self.assertEqual(self.quantities(), {product_id: 1 for product_id in product_ids})
+
+    def test_batch_endpoint_merges_repeated_products(self):
+        first, second = self.products[:2]
+        url = f'/store/carts/{self.cart.id}/items/batch/'
+        rows = [{'product_id': first.id, 'quantity': 1}, {'product_id': second.id, 'quantity': 2},
+                {'product_id': first.id, 'quantity': 3}]
+        response = APIClient().post(url, rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual({item['product_id']: item['quantity'] for item in response.data}, {first.id: 4, second.id: 2})
+        self.assertEqual(self.quantities(), {first.id: 4, second.id: 2})
+
+        response = APIClient().post(url, [{'product_id': 0, 'quantity': 1}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), {first.id: 4, second.id: 2})
+
+
+class CartTotalTest(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.cheap = Product.objects.create(title='Cheap', slug='cheap', unit_price=Decimal('9.99'), inventory=5,
+                                            collection=collection)
+        self.dear = Product.objects.create(title='Dear', slug='dear', unit_price=Decimal('120.50'), inventory=5,
+                                           collection=collection)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.cheap, quantity=3)
+        CartItem.objects.create(cart=self.cart, product=self.dear, quantity=2)
+
+    def test_totals_are_quantity_times_unit_price(self):
+        self.assertEqual(Cart.objects.with_total_price().get(pk=self.cart.pk).total_price, Decimal('270.97'))
+        totals = dict(CartItem.objects.with_total_price().filter(cart=self.cart)
+                                      .values_list('product_id', 'total_price'))
+        self.assertEqual(totals, {self.cheap.id: Decimal('29.97'), self.dear.id: Decimal('241.00')})
+
+        response = APIClient().get(f'/store/carts/{self.cart.id}/')
+        self.assertEqual(Decimal(str(response.data['total_price'])), Decimal('270.97'))
+        self.assertEqual({item['product']['id']: Decimal(str(item['total_price'])) for item in response.data['items']},
+                         totals)
+
+    def test_an_empty_cart_totals_zero(self):
+        empty = Cart.objects.create()
+        self.assertEqual(Cart.objects.with_total_price().get(pk=empty.pk).total_price, 0)
+        self.assertEqual(APIClient().get(f'/store/carts/{empty.id}/').data['total_price'], 0)
+        self.assertEqual(APIClient().post('/store/carts/').data['total_price'], 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'reads SQLite query plans')
+class AdviseIndexesTest(TestCase):
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            return explain_sqlite(cursor, sql, params, {'store_product', 'store_collection', 'store_order',
+                                                        'store_reservation'})
+
+    def test_scans_are_found_under_every_plan_format(self):
+        class Cursor:
+            def __init__(self, details):
+                self.details = details
+
+            def execute(self, sql, params):
+                pass
+
+            def fetchall(self):
+                return [(2, 0, 0, detail) for detail in self.details]
+
+        sql = 'SELECT * FROM "store_order" U0 INNER JOIN "store_product" T3 ON (U0."id" = T3."id")'
+        for details in (['SCAN store_order'], ['SCAN TABLE store_order'], ['SCAN TABLE store_order AS U0'],
+                        ['SCAN U0']):
+            self.assertEqual(explain_sqlite(Cursor(details), sql, [], {'store_order'}), ['full scan of store_order'])
+        self.assertEqual(explain_sqlite(Cursor(['SCAN T3 USING COVERING INDEX idx', 'SCAN store_cart',
+                                                'SEARCH U0 USING INTEGER PRIMARY KEY (rowid=?)']),
+                                        sql, [], {'store_order', 'store_product'}), [])
+
+    def test_the_new_indexes_serve_their_queries(self):
+        with connection.cursor() as cursor:
+            indexes = {name for table in ('store_product', 'store_collection', 'store_order')
+                       for name in connection.introspection.get_constraints(cursor, table)}
+        self.assertLessEqual({'store_produ_title_829862_idx', 'store_produ_unit_pr_2ca2a1_idx',
+                              'store_produ_last_up_34dd1f_idx', 'store_colle_title_ddb562_idx',
+                              'store_order_custome_700a25_idx', 'store_order_placed__61eeee_idx',
+                              'store_order_payment_11d454_idx'}, indexes)
+
+        for queryset in (Product.objects.filter(title__gt='M').order_by('title', 'id')[:10],
+                         Product.objects.order_by('-unit_price', '-id')[:10],
+                         Product.objects.order_by('last_update', 'id')[:10],
+                         Collection.objects.order_by('title'),
+                         Order.objects.filter(customer_id=1).order_by('-placed_at'),
+                         Order.objects.order_by('-placed_at', '-id')[:10],
+                         Order.objects.filter(payment_status='P').order_by('placed_at'),
+                         Reservation.objects.filter(expires_at__lte=timezone.now())):
+            self.assertEqual(self.explain(queryset), [], str(queryset.query))
+        self.assertEqual(self.explain(Product.objects.filter(inventory__lt=5).order_by()),
+                         ['full scan of store_product'])
+
+    def test_command(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'queries.jsonl')
+            cache.clear()
+            with override_settings(STORE_QUERY_LOG=path):
+                APIClient().get('/store/collections/')
+            with open(path, 'a') as log:
+                sql, params = Product.objects.filter(inventory__lt=5).order_by().query.sql_with_params()
+                for _ in range(2):
+                    log.write(json.dumps({'sql': sql, 'params': params, 'ms': 1.5}) + '\n')
+            out = StringIO()
+            call_command('advise_indexes', path, stdout=out)
+        self.assertIn('2 runs, 3.0 ms total', out.getvalue())
+        self.assertIn('full scan of store_product', out.getvalue())
+        # the collections page reads through the title index
+        self.assertRegex(out.getvalue(), r'[2-9] query shapes explained, 1 need an index')
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Collection')
+        # prices repeat, pages have to break the ties by id
+        for index in range(25):
+            Product.objects.create(title=f'Product {index:02}', slug=f'product-{index}', unit_price=10 + index % 3,
+                                   inventory=1, collection=collection)
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data['next']
+        return pages
+
+    def test_pages_forward_and_back(self):
+        for ordering in ['unit_price', '-unit_price', 'title']:
+            expected = list(Product.objects.order_by(ordering, 'id' if ordering[0] != '-' else '-id')
+                                           .values_list('id', flat=True))
+            pages = self.walk(f'/store/products/?cursor=&ordering={ordering}')
+            self.assertEqual([product['id'] for page in pages for product in page['results']], expected)
+            self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+
+            previous = APIClient().get(pages[-1]['previous']).data
+            self.assertEqual(previous['results'], pages[1]['results'])
+            self.assertIsNotNone(previous['next'])
+
+    def test_bad_cursors_are_not_found(self):
+        def cursor(**values):
+            return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        next_url = APIClient().get('/store/products/?cursor=&ordering=unit_price').data['next']
+        self.assertEqual(APIClient().get(next_url.replace('unit_price', 'last_update')).status_code, 404)
+        for url in [
+            '/store/products/?cursor=not-a-cursor',
+            f"/store/products/?ordering=unit_price&cursor={cursor(o='unit_price', v='abc', id=1)}",
+            f"/store/products/?ordering=last_update&cursor={cursor(o='last_update', v='abc', id=1)}",
+            f"/store/products/?ordering=unit_price&cursor={cursor(o='unit_price', v='1e30', id=1)}",
+            f"/store/products/?cursor={cursor(o='title', v='Product', id=10 ** 30)}",
+            f"/store/products/?cursor={cursor(o='title', v=None, id=1)}",
+            f"/store/products/?cursor={cursor(v='Product', id=1)}",
+        ]:
+            self.assertEqual(APIClient().get(url).status_code, 404, url)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the FTS5 index is SQLite only')
+class SQLiteSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Collection')
+        self.coffee = self.product('Coffee beans', 'Dark roast')
+        self.grinder = self.product('Grinder', 'For coffee beans')
+        self.product('Tea', 'Green')
+
+    def product(self, title, description):
+        return Product.objects.create(title=title, slug='product', description=description, unit_price=10,
+                                      inventory=1, collection=self.collection)
+
+    def search(self, *terms):
+        return list(SQLiteFTSBackend().search(Product.objects.all(), terms).values_list('id', flat=True))
+
+    def test_matches_every_term_as_a_prefix(self):
+        self.assertEqual(set(self.search('coffee')), {self.coffee.id, self.grinder.id})
+        self.assertEqual(set(self.search('cof', 'bea')), {self.coffee.id, self.grinder.id})
+        self.assertEqual(self.search('coffee', 'dark'), [self.coffee.id])
+        self.assertEqual(self.search('"quoted'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.coffee.title = 'Espresso'
+        self.coffee.description = ''
+        self.coffee.save()
+        self.assertEqual(self.search('espresso'), [self.coffee.id])
+        self.assertEqual(self.search('coffee'), [self.grinder.id])
+        self.grinder.delete()
+        self.assertEqual(self.search('coffee'), [])
+
+    def test_saves_that_keep_the_text_leave_the_index_alone(self):
+        product = Product.objects.get(pk=self.coffee.pk)
+        with CaptureQueriesContext(connection) as queries:
+            product.inventory = 5
+            product.save()
+            product.title = 'Coffee beans'
+            product.save()
+            product.description = 'Espresso roast'
+            product.save(update_fields=['inventory'])
+        self.assertFalse([query for query in queries if FTS_TABLE in query['sql']])
+        self.assertEqual(self.search('espresso'), [])
+        product.save(update_fields=['description'])
+        self.assertEqual(self.search('espresso'), [self.coffee.id])
+
+    def test_like_backend(self):
+        with self.settings(STORE_SEARCH_BACKEND='store.search.LikeBackend'):
+            response = APIClient().get('/store/products/?search=coffee beans')
+        self.assertEqual({product['id'] for product in response.data['results']}, {self.coffee.id, self.grinder.id})
+        self.assertEqual(list(LikeBackend().search(Product.objects.all(), ['COFFEE', 'dark'])
+                              .values_list('id', flat=True)), [self.coffee.id])
+
+    def test_keyset_pages_of_a_search_are_in_title_order(self):
+        response = APIClient().get('/store/products/?search=coffee&cursor=')
+        self.assertEqual([product['title'] for product in response.data['results']], ['Coffee beans', 'Grinder'])
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(title='Product', slug='product', unit_price=10, inventory=5,
+                                              collection=collection)
+        self.url = f'/store/products/{self.product.id}/'
+
+    def test_pages_are_cached_until_a_save(self):
+        self.assertEqual(APIClient().get(self.url).data['inventory'], 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(APIClient().get(self.url).data['inventory'], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.inventory = 3
+            self.product.save()
+        self.assertEqual(APIClient().get(self.url).data['inventory'], 3)
+
+    def test_revalidation(self):
+        etag = APIClient().get(self.url)['ETag']
+        response = APIClient().get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    @patch.object(ProductViewSet, 'cache_timeout', 0)
+    def test_changes_that_skip_the_signals_are_not_answered_with_304(self):
+        # as once the cached page times out
+        etag = APIClient().get(self.url)['ETag']
+        self.assertEqual(APIClient().get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.filter(pk=self.product.pk).update(inventory=1)
+        response = APIClient().get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_clearing_inventory_in_the_admin_drops_cached_pages(self):
+        APIClient().get(self.url)
+        product_admin = ProductAdmin(Product, AdminSite())
+        with self.captureOnCommitCallbacks(execute=True), patch.object(product_admin, 'message_user'):
+            product_admin.clear_inventory(None, Product.objects.all())
+        self.assertEqual(APIClient().get(self.url).data['inventory'], 0)
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = [
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', unit_price=10, inventory=10, collection=collection)
+            for i in range(3)
+        ]
+
+    def test_repeated_query_shapes_are_flagged(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, '3 queries of the same shape'):
+            with query_budget():
+                for product in self.products:
+                    Product.objects.get(pk=product.pk)
+
+    def test_going_over_the_budget_is_flagged(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'over a budget of 1'):
+            with query_budget(1):
+                Product.objects.count()
+                Collection.objects.count()
+
+    def test_views_over_their_budget_fail_under_the_test_runner(self):
+        # a cached page would answer without any query
+        cache.clear()
+        with self.settings(STORE_QUERY_BUDGET_STRICT=True), self.assertRaises(QueryBudgetExceeded):
+            with patch.object(CollectionViewSet, 'query_budget', 0):
+                APIClient().get('/store/collections/')
+
+
+class WriteQueryBudgetTest(TestCase):
+    ''' Admin writes run exactly their view's query_budget in the worst case, under the strict test runner.
+    '''
+    def setUp(self):
+        cache.clear()
+        # a cold content type cache mustn't cost the tags a query
+        ContentType.objects.clear_cache()
+        self.coffee = Collection.objects.create(title='Coffee')
+        self.tea = Collection.objects.create(title='Tea')
+        self.product = Product.objects.create(title='Product', slug='product', unit_price=10, inventory=5,
+                                              collection=self.coffee)
+        admin = get_user_model().objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+        # a real token, so the JWT user lookup is counted like it is in production
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(admin)}')
+
+    def write(self, view_class, action, method, url, data=None):
+        with self.settings(STORE_QUERY_BUDGET_STRICT=True):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300)
+        self.assertEqual(response.wsgi_request.query_recorder.count, view_class.query_budget[action])
+
+    def test_product_create(self):
+        self.write(ProductViewSet, 'create', 'post', '/store/products/',
+                   {'title': 'New', 'slug': 'new', 'unit_price': 5, 'inventory': 2, 'collection': self.coffee.id})
+
+    def test_product_update(self):
+        self.write(ProductViewSet, 'update', 'put', f'/store/products/{self.product.id}/',
+                   {'title': 'Renamed', 'slug': 'product', 'unit_price': 12, 'inventory': 5, 'collection': self.tea.id})
+
+    def test_product_partial_update(self):
+        self.write(ProductViewSet, 'partial_update', 'patch', f'/store/products/{self.product.id}/',
+                   {'title': 'Renamed', 'unit_price': 12, 'collection': self.tea.id})
+
+    def test_product_destroy(self):
+        self.write(ProductViewSet, 'destroy', 'delete', f'/store/products/{self.product.id}/')
+
+    def test_collection_create(self):
+        self.write(CollectionViewSet, 'create', 'post', '/store/collections/', {'title': 'New'})
+
+    def test_collection_update(self):
+        self.write(CollectionViewSet, 'update', 'put', f'/store/collections/{self.tea.id}/', {'title': 'Renamed'})
+
+    def test_collection_partial_update(self):
+        self.write(CollectionViewSet, 'partial_update', 'patch', f'/store/collections/{self.tea.id}/',
+                   {'title': 'Renamed'})
+
+    def test_collection_destroy(self):
+        self.write(CollectionViewSet, 'destroy', 'delete', f'/store/collections/{self.tea.id}/')
+
+
+class ProductTagsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(title='Product', slug='product', unit_price=10, inventory=5,
+                                              collection=self.collection)
+        TaggedItem.objects.create(tag=Tag.objects.create(label='sale'), content_object=self.product)
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', is_staff=True))
+
+    def test_reads_and_writes_return_the_tags(self):
+        url = f'/store/products/{self.product.id}/'
+        self.assertEqual(self.client.get(url).data['tags'], ['sale'])
+        self.assertEqual(self.client.patch(url, {'inventory': 3}, format='json').data['tags'], ['sale'])
+        self.assertEqual(ProductSerializer(self.product).data['tags'], ['sale'])
+
+    def test_new_products_have_no_tags_without_a_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/store/products/', {'title': 'New', 'slug': 'new', 'unit_price': 5,
+                                                             'inventory': 2, 'collection': self.collection.id})
+        self.assertEqual(response.data['tags'], [])
+        self.assertFalse([query for query in queries if 'tags_taggeditem' in query['sql']])
+
+
+class ProductBatchTest(TestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Collection')
+        self.products = [Product.objects.create(title=f'Product {index}', slug=f'product-{index}', unit_price=10,
+                                                inventory=5, collection=self.collection) for index in range(2)]
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', is_staff=True))
+
+    def test_create(self):
+        rows = [{'title': f'New {index}', 'slug': 'new', 'unit_price': 20, 'inventory': 3,
+                 'collection': self.collection.id} for index in range(3)]
+        response = self.client.post('/store/products/batch/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        created = Product.objects.filter(slug='new').order_by('id')
+        self.assertEqual([product['id'] for product in response.data], [product.id for product in created])
+        self.assertEqual([product['title'] for product in response.data], ['New 0', 'New 1', 'New 2'])
+        self.assertEqual(created[0].price_with_tax, Decimal('22.00'))
+        self.assertEqual(Collection.objects.get(pk=self.collection.id).products_count, 5)
+
+        # as on MySQL, the ids are read back by slug, which the products above already use
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            response = self.client.post('/store/products/batch/', rows[:2], format='json')
+        self.assertEqual([product['id'] for product in response.data], list(created.all()[3:].values_list('id', flat=True)))
+
+    def test_update_only_writes_the_fields_of_each_row(self):
+        first, second = self.products
+        to_internal_value = ProductListSerializer.to_internal_value
+
+        def checkout_between_validation_and_write(serializer, data):
+            validated = to_internal_value(serializer, data)
+            Product.objects.filter(pk=first.pk).update(inventory=1)
+            return validated
+
+        with patch.object(ProductListSerializer, 'to_internal_value', checkout_between_validation_and_write):
+            response = self.client.patch('/store/products/batch/', [{'id': first.id, 'unit_price': 30},
+                                                                    {'id': second.id, 'inventory': 9}], format='json')
+        self.assertEqual(response.status_code, 200)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.unit_price, first.price_with_tax, first.inventory), (30, Decimal('33.00'), 1))
+        self.assertEqual((second.unit_price, second.inventory), (10, 9))
+
+    def test_partial_rows_report_errors_by_index(self):
+        rows = [{'id': self.products[0].id, 'inventory': 7}, {'id': 0, 'inventory': 1},
+                {'id': self.products[1].id, 'inventory': -1}]
+        self.assertEqual(self.client.patch('/store/products/batch/', rows, format='json').status_code, 400)
+
+        response = self.client.patch('/store/products/batch/?partial=true', rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['id'] for product in response.data['results']], [self.products[0].id])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('id', response.data['errors'][0]['errors'])
+        self.assertIn('inventory', response.data['errors'][1]['errors'])
+
+    def test_delete(self):
+        customer = get_user_model().objects.create_user(username='buyer', email='buyer@example.com').customer
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=1, unit_price=10)
+        ids = [product.id for product in self.products]
+
+        self.assertEqual(self.client.delete('/store/products/batch/', ids, format='json').status_code, 400)
+        response = self.client.delete('/store/products/batch/?partial=true', ids + [0], format='json')
+        self.assertEqual(response.data['deleted'], [self.products[1].id])
+        self.assertEqual({error['id'] for error in response.data['errors']}, {0, self.products[0].id})
+        self.assertEqual(list(Product.objects.filter(pk__in=ids).values_list('pk', flat=True)), [self.products[0].id])
+
+
+class PricingTest(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(title='Product', slug='product', unit_price=10, inventory=5,
+                                              collection=collection)
+        self.promotion = Promotion.objects.create(description='Half off', discount=0.5)
+
+    def price(self):
+        return Product.objects.get(pk=self.product.pk).price_with_tax
+
+    def test_price_with_tax(self):
+        self.assertEqual(pricing.price_with_tax('10', 0.2, Decimal('0.10')), Decimal('8.80'))
+        self.assertEqual(pricing.price_with_tax(Decimal('9.99'), None, Decimal('0.10')), Decimal('10.99'))
+        # discounts are clamped to 0 to 1
+        self.assertEqual(pricing.price_with_tax(10, 1.5, Decimal('0.10')), Decimal('0.00'))
+        self.assertEqual(pricing.price_with_tax(10, -0.5, Decimal('0.10')), Decimal('11.00'))
+        with self.settings(STORE_TAX_RATE='0.20'):
+            self.assertEqual(pricing.price_with_tax(10), Decimal('12.00'))
+
+    def test_promotion_changes_reprice_their_products(self):
+        self.assertEqual(self.price(), Decimal('11.00'))
+        self.product.promotions.add(self.promotion)
+        self.assertEqual(self.price(), Decimal('5.50'))
+        self.promotion.discount = 0.2
+        self.promotion.save()
+        self.assertEqual(self.price(), Decimal('8.80'))
+        self.product.promotions.remove(self.promotion)
+        self.assertEqual(self.price(), Decimal('11.00'))
+
+        self.promotion.product_set.add(self.product)
+        self.assertEqual(self.price(), Decimal('8.80'))
+        self.promotion.product_set.clear()
+        self.assertEqual(self.price(), Decimal('11.00'))
+
+        self.product.promotions.add(self.promotion)
+        self.promotion.delete()
+        self.assertEqual(self.price(), Decimal('11.00'))
+
+    def test_saves_reprice_only_when_the_unit_price_changes(self):
+        self.product.promotions.add(self.promotion)
+        product = Product.objects.get(pk=self.product.pk)
+        with CaptureQueriesContext(connection) as queries:
+            product.inventory = 3
+            product.save()
+        self.assertFalse([query for query in queries if 'store_promotion' in query['sql']])
+        self.assertEqual(self.price(), Decimal('5.50'))
+
+        product.unit_price = Decimal('20')
+        product.save()
+        self.assertEqual(self.price(), Decimal('11.00'))
+        product.unit_price = Decimal('30')
+        product.save(update_fields=['unit_price'])
+        self.assertEqual(self.price(), Decimal('16.50'))
+
+    def test_refresh_prices(self):
+        other = Product.objects.create(title='Other', slug='other', unit_price=20, inventory=5,
+                                       collection=self.product.collection)
+        self.product.promotions.add(self.promotion)
+        with self.settings(STORE_TAX_RATE='0.20'):
+            self.assertEqual(pricing.refresh_prices([self.product.pk]), 1)
+            self.assertEqual(self.price(), Decimal('6.00'))
+            self.assertEqual(other.price_with_tax, Product.objects.get(pk=other.pk).price_with_tax)
+            self.assertEqual(pricing.refresh_prices(batch_size=1), 1)
+            self.assertEqual(Product.objects.get(pk=other.pk).price_with_tax, Decimal('24.00'))
+            self.assertEqual(pricing.refresh_prices(), 0)
+
+
+class CollectionCountTest(TestCase):
+    def setUp(self):
+        self.coffee = Collection.objects.create(title='Coffee')
+        self.tea = Collection.objects.create(title='Tea')
+        self.products = [Product.objects.create(title=f'Product {index}', slug=f'product-{index}', unit_price=10,
+                                                inventory=5, collection=self.coffee) for index in range(2)]
+
+    def counts(self):
+        return dict(Collection.objects.filter(pk__in=[self.coffee.pk, self.tea.pk])
+                                      .values_list('title', 'products_count'))
+
+    def test_counts_follow_creates_moves_and_deletes(self):
+        self.assertEqual(self.counts(), {'Coffee': 2, 'Tea': 0})
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.collection = self.tea
+        product.save()
+        self.assertEqual(self.counts(), {'Coffee': 1, 'Tea': 1})
+        # saving again doesn't move it twice
+        product.save()
+        self.assertEqual(self.counts(), {'Coffee': 1, 'Tea': 1})
+        product.delete()
+        self.products[1].delete()
+        self.assertEqual(self.counts(), {'Coffee': 0, 'Tea': 0})
+
+    def test_saving_a_collection_keeps_the_count(self):
+        coffee = Collection.objects.get(pk=self.coffee.pk)
+        Product.objects.create(title='Late', slug='late', unit_price=10, inventory=5, collection=self.coffee)
+        coffee.title = 'Beans'
+        coffee.save()
+        self.assertEqual(self.counts(), {'Beans': 3, 'Tea': 0})
+
+    def test_recount(self):
+        # queryset updates skip the signals
+        Product.objects.update(collection=self.tea)
+        self.assertEqual(self.counts(), {'Coffee': 2, 'Tea': 0})
+        self.assertEqual(Collection.objects.recount_products([self.tea.pk]), 1)
+        self.assertEqual(self.counts(), {'Coffee': 2, 'Tea': 2})
+
+        out = StringIO()
+        call_command('recount_collection_products', '--dry-run', stdout=out)
+        self.assertIn(f'Coffee (#{self.coffee.pk}): 2 -> 0', out.getvalue())
+        self.assertEqual(self.counts(), {'Coffee': 2, 'Tea': 2})
+        call_command('recount_collection_products', stdout=out)
+        self.assertIn('Repaired 1 collections.', out.getvalue())
+        self.assertEqual(self.counts(), {'Coffee': 0, 'Tea': 2})
+
+    def test_only_empty_collections_can_be_deleted(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', is_staff=True))
+        self.products[1].delete()
+        response = client.delete(f'/store/collections/{self.coffee.pk}/')
+        self.assertEqual(response.data, {'error': 'Cannot delete collection as it contains products'})
+        self.assertTrue(Collection.objects.filter(pk=self.coffee.pk).exists())
+
+        self.assertEqual(client.delete(f'/store/collections/{self.tea.pk}/').status_code, 204)
+        self.assertFalse(Collection.objects.filter(pk=self.tea.pk).exists())
+
+
+class ProductImportTest(TestCase):
+    def test_invalid_rows_are_skipped_and_the_rest_round_trips(self):
+        Collection.objects.create(title='Coffee')
+        rows = [
+            'title,slug,description,unit_price,inventory,collection',
+            'Beans,beans,,12.50,4,Coffee',
+            'Too dear,too-dear,,12345678,1,Coffee',
+            'Negative,negative,,10,-1,Coffee',
+            'Bad slug,bad slug,,10,1,Coffee',
+            'Grinder,grinder,Hand,40.00,2,Coffee',
+        ]
+        stderr = StringIO()
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.csv')
+            with open(path, 'w') as file:
+                file.write('\n'.join(rows) + '\n')
+            call_command('import_products', path, stdout=StringIO(), stderr=stderr)
+
+        self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['beans', 'grinder'])
+        self.assertEqual([line.split(':')[0] for line in stderr.getvalue().splitlines()], ['row 2', 'row 3', 'row 4'])
+        self.assertIn('unit_price', stderr.getvalue())
+
+        stdout = StringIO()
+        call_command('export_products', '--format', 'csv', stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [rows[0], rows[1], rows[5]])
+
+
+class ValuesSerializerTest(TestCase):
+    ''' The .values() serializers render the same bytes as the ModelSerializers they stand in for.
+    '''
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = [
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', unit_price=f'{i}9.95', inventory=i,
+                                   description='Described' if i % 2 else None, collection=collection)
+            for i in range(1, 4)
+        ]
+        tag = Tag.objects.create(label='sale')
+        TaggedItem.objects.create(tag=tag, content_type=ContentType.objects.get_for_model(Product),
+                                  object_id=self.products[0].id)
+
+        cart = Cart.objects.create()
+        Cart.objects.create()
+        for product in self.products:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        customer = Customer.objects.get(user=get_user_model().objects.create_user(username='c', email='c@example.com'))
+        for status in ['P', 'C']:
+            order = Order.objects.create(customer=customer, payment_status=status)
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.unit_price)
+
+    def assertSameJSON(self, queryset, serializer_class, values_class):
+        values = values_class()
+        self.assertEqual(JSONRenderer().render(values.serialize(values.values(queryset))),
+                         JSONRenderer().render(serializer_class(queryset, many=True).data))
+
+    def test_products(self):
+        self.assertSameJSON(Product.objects.all(), ProductSerializer, ProductValues)
+
+    def test_collections(self):
+        self.assertSameJSON(Collection.objects.all(), CollectionSerializer, CollectionValues)
+
+    def test_carts(self):
+        self.assertSameJSON(CartViewSet.queryset.order_by('created_at'), CartSerializer, CartValues)
+
+    def test_orders(self):
+        self.assertSameJSON(Order.objects.prefetch_related('items__product').order_by('id'), OrderSerializer, OrderValues)
+
+
+class FastJSONTest(TestCase):
+    ''' FastJSONRenderer and FastJSONParser are drop-in replacements for DRF's JSON renderer and parser.
+    '''
+    data = {
+        'id': uuid4(),
+        'price': Decimal('19.90'),
+        'placed_at': timezone.now(),
+        'birth_date': date(1990, 1, 31),
+        'title': 'Caf\u00e9 \u2028 \U0001f600',
+        'errors': [ErrorDetail('This field is required.', code='required')],
+        'items': [{1: None, 'quantity': 2, 'ratio': 0.1}],
+    }
+
+    def test_renders_the_same_bytes(self):
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_indented_output_is_unchanged(self):
+        media_type = 'application/json; indent=4'
+        self.assertEqual(FastJSONRenderer().render(self.data, media_type), JSONRenderer().render(self.data, media_type))
+
+    def test_parses_the_same_data(self):
+        body = FastJSONRenderer().render(self.data)
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"price": NaN}'))
+
+
+def store_urlconf(async_views):
+    urlconf = ModuleType(f'store_urls_async_{async_views}')
+    urlconf.urlpatterns = [path('store/', include(get_urlpatterns(async_views)))]
+    return urlconf
+
+
+class AsyncViewSetTest(TestCase):
+    ''' The async catalogue viewsets answer exactly like the sync ones.
+    '''
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Collection')
+        self.products = [
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', unit_price=10 + i, inventory=i,
+                                   collection=self.collection)
+            for i in range(12)
+        ]
+        self.review = Review.objects.create(product=self.products[0], name='Reviewer', description='Fine')
+
+    def get(self, async_views, url):
+        cache.clear()
+        with override_settings(ROOT_URLCONF=store_urlconf(async_views)):
+            return APIClient().get(url)
+
+    def test_reads_match_the_sync_views(self):
+        product = self.products[0]
+        for url in ['/store/products/', '/store/products/?page=2', '/store/products/?page=9',
+                    '/store/products/?cursor=&ordering=-unit_price', f'/store/products/?collection_id={self.collection.id}',
+                    '/store/products/?collection_id=0', '/store/products/?search=Product', f'/store/products/{product.id}/',
+                    '/store/products/0/', '/store/collections/', f'/store/collections/{self.collection.id}/',
+                    f'/store/products/{product.id}/reviews/', f'/store/products/{product.id}/reviews/{self.review.id}/']:
+            sync, asynchronous = self.get(False, url), self.get(True, url)
+            self.assertEqual((asynchronous.status_code, asynchronous.content), (sync.status_code, sync.content), url)
+
+    def test_writes_still_check_permissions(self):
+        with override_settings(ROOT_URLCONF=store_urlconf(True)):
+            client = APIClient()
+            self.assertEqual(client.post('/store/collections/', {'title': 'New'}).status_code, 401)
+            client.force_authenticate(get_user_model().objects.create_user(
+                username='admin', email='admin@example.com', is_staff=True))
+            self.assertEqual(client.post('/store/collections/', {'title': 'New'}).status_code, 201)
+        self.assertTrue(Collection.objects.filter(title='New').exists())
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def connect(self):
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def test_overflow_connections_are_closed_when_they_come_back(self):
+        pool = ConnectionPool(size=1, max_overflow=1, timeout=0.01)
+        first, second = pool.acquire(self.connect), pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+        pool.release(first)
+        pool.release(second)
+        self.assertIs(pool.acquire(self.connect), first)
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['opened'], stats['reused'], stats['discarded'], stats['timeouts']),
+                         (1, 2, 1, 1, 1))
+
+    def test_waits_for_a_connection_to_come_back(self):
+        pool = ConnectionPool(size=1, max_overflow=0, timeout=5)
+        held = pool.acquire(self.connect)
+        threading.Timer(0.05, pool.release, [held]).start()
+        self.assertIs(pool.acquire(self.connect), held)
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreaterEqual(stats['wait_ms_max'], 40)
+
+    def test_database_wrapper_returns_connections_to_the_pool(self):
+        with TemporaryDirectory() as directory:
+            wrapper = ConnectionHandler({'default': {
+                'ENGINE': 'store.db.backends.sqlite3',
+                'NAME': f'{directory}/pool.sqlite3',
+                'CONN_HEALTH_CHECKS': True,
+                'POOL': {'SIZE': 2},
+            }})['default']
+            wrapper.ensure_connection()
+            reused = wrapper.connection
+            wrapper.close()
+            self.assertIsNone(wrapper.connection)
+            self.assertEqual(wrapper.pool.stats()['idle'], 1)
+
+            wrapper.ensure_connection()
+            self.assertIs(wrapper.connection, reused)
+            # a connection that saw an error isn't handed out again
+            wrapper.errors_occurred = True
+            wrapper.close()
+            wrapper.ensure_connection()
+            self.assertIsNot(wrapper.connection, reused)
+            wrapper.close()
+            wrapper.pool.close()
+
+    def test_health_check(self):
+        wrapper = ConnectionHandler({'default': {'ENGINE': 'store.db.backends.sqlite3', 'NAME': ':memory:'}})['default']
+        connection = self.connect()
+        self.assertTrue(wrapper.check_connection(connection))
+        connection.close()
+        self.assertFalse(wrapper.check_connection(connection))
+
+
+@skipUnless('replica' in settings.DATABASES, 'needs a replica database, see storefront/settings_local.py')
+@override_settings(STORE_READ_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    ''' The replica holds different rows than the primary here, so every answer shows where it was read from.
+    '''
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        replica_monitor.checked_at = None
+        self.addCleanup(setattr, replica_monitor, 'fresh', [])
+        self.product = Product.objects.create(title='Primary', slug='primary', unit_price=10, inventory=1,
+                                              collection=Collection.objects.create(title='Collection'))
+        Product.objects.using('replica').create(id=self.product.id, title='Replica', slug='replica', unit_price=10,
+                                                inventory=1, collection=Collection.objects.using('replica').create(
+                                                    id=self.product.collection_id, title='Collection'))
+        self.client = APIClient()
+
+    def title(self):
+        return self.client.get(f'/store/products/{self.product.id}/').data['title']
+
+    def test_catalogue_reads_go_to_the_replica(self):
+        self.assertEqual(self.title(), 'Replica')
+
+    def test_clients_read_their_own_writes(self):
+        self.assertEqual(self.client.post('/store/carts/').status_code, 201)
+        self.assertEqual(self.title(), 'Primary')
+        # the page read from the primary was cached for everyone
+        cache.clear()
+        self.assertEqual(APIClient().get(f'/store/products/{self.product.id}/').data['title'], 'Replica')
+
+    def test_lagging_replicas_are_skipped(self):
+        with patch.object(ReplicaMonitor, 'get_lag', return_value=60):
+            self.assertEqual(self.title(), 'Primary')
+
+    def test_instances_read_from_the_replica_are_saved_to_the_primary(self):
+        product = Product.objects.using('replica').get(pk=self.product.pk)
+        product.title = 'Saved'
+        product.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).title, 'Saved')
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        collection = Collection.objects.create(title='Collection')
+        Product.objects.create(title='Product', slug='product', unit_price=10, inventory=1, collection=collection)
+        self.admin = APIClient()
+        self.admin.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', is_staff=True))
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        for quantile in (0.5, 0.9, 0.99):
+            self.assertAlmostEqual(histogram.percentile(quantile), quantile * 100000, delta=quantile * 100000 / 64)
+        self.assertEqual(histogram.percentile(1), 100000)
+        self.assertLess(len(histogram.counts), 1000)
+
+    def test_requests_are_recorded_per_route(self):
+        APIClient().get('/store/products/')
+        APIClient().get('/store/collections/1000/')
+        self.assertEqual(APIClient().get('/store/metrics/').status_code, 401)
+
+        response = self.admin.get('/store/metrics/')
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('store_request_duration_seconds_count{route="products",action="list"} 1', metrics)
+        self.assertIn('store_request_queries_count{route="products",action="list"} 1', metrics)
+        self.assertIn('store_responses_total{route="collections",action="retrieve",status="404"} 1', metrics)
+
+    def test_sampled_profiles_are_written(self):
+        with TemporaryDirectory() as directory, \
+                override_settings(STORE_PROFILE_ROUTES={'products': 1}, STORE_PROFILE_DIR=directory):
+            APIClient().get('/store/products/')
+            APIClient().get('/store/collections/')
+            names = os.listdir(directory)
+            self.assertEqual(len(names), 1)
+            self.assertTrue(names[0].startswith('products.list.'))
+            self.assertTrue(pstats.Stats(os.path.join(directory, names[0])).total_calls)
+
+
+class ApiBenchmarkTest(TestCase):
+    def test_every_scenario_runs_within_its_query_budget(self):
+        dataset = seed_dataset(30)
+        self.assertEqual(Collection.objects.get(pk=dataset.collection_ids[0]).products_count,
+                         Product.objects.filter(collection_id=dataset.collection_ids[0]).count())
+        results = run_api(dataset, list(API_SCENARIOS), repeat=2)
+        self.assertEqual(list(results), list(API_SCENARIOS))
+        self.assertTrue(all(result['queries'] for result in results.values()))
+
+    def test_compare_flags_regressions(self):
+        baseline = {'products-list': {'p50_ms': 10, 'p99_ms': 20, 'queries': 3, 'peak_kb': 100}}
+        results = {'products-list': {'p50_ms': 11, 'p99_ms': 30, 'queries': 4, 'peak_kb': 100}}
+        regressed = {metric for _, metric, *_, regressed in compare(results, baseline, 0.2) if regressed}
+        self.assertEqual(regressed, {'p99_ms', 'queries'})
+
+
+class SeedingTest(TestCase):
+    def test_generated_rows_point_at_each_other(self):
+        plan = Plan(seed=1, products=60, customers=12, chunk_size=25)
+        counts = seed(plan)
+        self.assertEqual(Product.objects.filter(pk__in=plan.ids('product')).count(), counts['product'])
+        # one customer per user, as the signal would have created
+        self.assertEqual(Customer.objects.filter(user_id__in=plan.ids('user')).count(), 12)
+        self.assertEqual(Order.objects.filter(customer_id__in=plan.ids('customer')).count(), counts['order'])
+        for item in OrderItem.objects.filter(order_id__in=plan.ids('order')).select_related('product'):
+            self.assertEqual(item.unit_price, item.product.unit_price)
+        for collection in Collection.objects.filter(pk__in=plan.ids('collection')):
+            self.assertEqual(collection.products_count, collection.products.count())
+        self.assertEqual(sum(LikeCount.objects.values_list('count', flat=True)), LikedItem.objects.count())
+
+    def test_seeding_again_with_the_same_seed_adds_rows(self):
+        counts = seed(Plan(seed=1, products=20, customers=4))
+        seed(Plan(seed=1, products=20, customers=4))
+        self.assertEqual(Product.objects.count(), counts['product'] * 2)
+        self.assertEqual(Cart.objects.count(), counts['cart'] * 2)
+
+
+
+# hashing with the default PBKDF2 iterations would take most of the test
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+class ProvisioningTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', is_staff=True))
+
+    def rows(self, first, count):
+        return [{'username': f'user{index}', 'email': f'user{index}@example.com', 'password': f'Secret-{index}!x',
+                 'membership': 'G'} for index in range(first, first + count)]
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+    def test_batch_signs_up_users_with_one_customer_each(self):
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.post('/store/customers/batch/', self.rows(0, 3), format='json')
+        self.assertEqual(response.status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            self.client.post('/store/customers/batch/', self.rows(3, 6), format='json')
+        # no query per row
+        self.assertEqual(len(large), len(small))
+
+        users = get_user_model().objects.filter(username__startswith='user')
+        self.assertEqual(users.count(), 9)
+        self.assertEqual(Customer.objects.filter(user__in=users, membership='G').count(), 9)
+        self.assertTrue(users.get(username='user4').check_password('Secret-4!x'))
+        self.assertEqual(response.data[0]['user_id'], users.get(username='user0').id)
+        # single sign-ups still get their customer from the signal
+        user = get_user_model().objects.create_user(username='single', email='single@example.com')
+        self.assertTrue(Customer.objects.filter(user=user).exists())
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+    def test_taken_usernames_and_emails_are_rejected(self):
+        # in any case, as MySQL compares them
+        rows = self.rows(0, 2) + [{'username': 'Admin', 'email': 'new@example.com'},
+                                  {'username': 'other', 'email': 'USER0@example.com'},
+                                  {'username': 'USER1', 'email': 'another@example.com'}]
+        self.assertEqual(self.client.post('/store/customers/batch/', rows, format='json').status_code, 400)
+        self.assertEqual(APIClient().post('/store/customers/batch/', rows, format='json').status_code, 401)
+
+        response = self.client.post('/store/customers/batch/?partial=true', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['username'] for result in response.data['results']], ['user0', 'user1'])
+        self.assertEqual([error['index'] for error in response.data['errors']], [2, 3, 4])
+        self.assertIn('username', response.data['errors'][0]['errors'])
+        self.assertIn('email', response.data['errors'][1]['errors'])
+        self.assertIn('username', response.data['errors'][2]['errors'])
+
+    def test_passwords_are_hashed_in_worker_processes(self):
+        with patch.object(provisioning, 'POOL_THRESHOLD', 1):
+            hashed = provisioning.hash_passwords(['first', None, 'second'], processes=2)
+        self.assertTrue(check_password('first', hashed[0]))
+        self.assertFalse(is_password_usable(hashed[1]))
+        self.assertTrue(check_password('second', hashed[2]))
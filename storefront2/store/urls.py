@@ -1,18 +1,30 @@
+from django.conf import settings
+from django.urls import path
 from rest_framework_nested.routers import DefaultRouter, NestedDefaultRouter
 from . import views
 
-router = DefaultRouter()
 
-router.register('products', views.ProductViewSet, basename="products")
-router.register('collections', views.CollectionViewSet)
-router.register('carts', views.CartViewSet)
-router.register('customers', views.CustomerViewSet)
-router.register('orders', views.OrderViewSet, basename='orders')
+def get_urlpatterns(async_views=False):
+    # async_views answers the catalogue reads on the event loop, see store.viewsets.AsyncViewSetMixin
+    router = DefaultRouter()
+
+    router.register('products', views.AsyncProductViewSet if async_views else views.ProductViewSet, basename="products")
+    # the basenames label the routes in store.metrics
+    router.register('collections', views.AsyncCollectionViewSet if async_views else views.CollectionViewSet,
+                    basename='collections')
+    router.register('carts', views.CartViewSet, basename='carts')
+    router.register('customers', views.CustomerViewSet, basename='customers')
+    router.register('orders', views.OrderViewSet, basename='orders')
+
+    products_router = NestedDefaultRouter(parent_router=router, parent_prefix="products", lookup='product')
+    products_router.register("reviews", views.AsyncReviewViewSet if async_views else views.ReviewViewSet,
+                             basename='product-reviews')
+    carts_router = NestedDefaultRouter(parent_router=router, parent_prefix="carts", lookup='cart')
+    carts_router.register("items", views.CartItemViewSet, basename='cart-items')
+
+    metrics = [path('metrics/', views.MetricsView.as_view())]
+    return router.urls + products_router.urls + carts_router.urls + metrics
 
-products_router = NestedDefaultRouter(parent_router=router, parent_prefix="products", lookup='product')
-products_router.register("reviews", views.ReviewViewSet, basename='product-reviews')
-carts_router = NestedDefaultRouter(parent_router=router, parent_prefix="carts", lookup='cart')
-carts_router.register("items", views.CartItemViewSet, basename='cart-items')
 
 # URLConf
-urlpatterns = router.urls + products_router.urls + carts_router.urls
+urlpatterns = get_urlpatterns(getattr(settings, 'STORE_ASYNC_VIEWS', False))
@@ -0,0 +1,216 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import QuerySet
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from tags.models import TaggedItem
+from .metrics import timed
+from .models import CartItem, OrderItem, Product
+from .serializers import CartItemSerializer, CartSerializer, CollectionSerializer, OrderItemSerializer, \
+OrderSerializer, ProductSerializer, ReviewSerializer
+from .viewsets import aget_object_or_404
+
+
+# Read-only twins of the ModelSerializers behind the busiest GET endpoints. They select the columns with .values()
+# and build every dict from accessors compiled once from the ModelSerializer's own fields, which skips DRF's
+# per-field get_attribute()/to_representation() dispatch and model instantiation but renders exactly the same JSON.
+
+# to_representation() of these returns the column value as it is
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField)
+
+
+class ValuesSerializer:
+    '''
+    Serializes .values() rows of serializer_class's model. Plain fields, primary key relations and nested
+    single serializers are compiled from serializer_class. Any other field, like a many=True nested serializer or a
+    SerializerMethodField, needs a get_<field>(row) method on the subclass. prepare(rows) runs first with the whole
+    batch of rows to load what those methods need, and extra_columns are selected for them.
+    '''
+    serializer_class = None
+    extra_columns = ()
+
+    def __init__(self, context=None):
+        serializer = self.serializer_class(context=context or {})
+        self.columns = list(self.extra_columns)
+        self.accessors = self.compile(serializer, '')
+
+    def compile(self, serializer, prefix):
+        model = serializer.Meta.model
+        accessors = []
+        for key, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if not prefix and hasattr(self, f'get_{key}'):
+                accessors.append((key, None, getattr(self, f'get_{key}')))
+                continue
+
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                column, convert = model._meta.get_field(field.source).attname, None
+            elif isinstance(field, serializers.Serializer):
+                column = prefix + model._meta.get_field(field.source).attname
+                nested = self.compile(field, f'{prefix}{field.source}__')
+                convert = lambda row, nested=nested, column=column: \
+                    None if row[column] is None else self.build(row, nested)
+                accessors.append((key, None, convert))
+                self.columns.append(column)
+                continue
+            elif field.source == '*' or isinstance(field, (serializers.ListSerializer, serializers.SerializerMethodField)):
+                raise ImproperlyConfigured(f'{type(self).__name__} needs a get_{key}(row) method')
+            else:
+                column = field.source.replace('.', '__')
+                convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+
+            accessors.append((key, prefix + column, convert))
+            self.columns.append(prefix + column)
+        return accessors
+
+    def build(self, row, accessors):
+        item = {}
+        for key, column, convert in accessors:
+            if column is None:
+                item[key] = convert(row)
+            else:
+                value = row[column]
+                item[key] = value if convert is None or value is None else convert(value)
+        return item
+
+    def values(self, queryset, *columns):
+        # the prefetches of the ModelSerializer's queryset are replaced by prepare()
+        return queryset.prefetch_related(None).values(*dict.fromkeys(self.columns + list(columns)))
+
+    def prepare(self, rows):
+        pass
+
+    def serialize(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        with timed('serialize'):
+            return [self.build(row, self.accessors) for row in rows]
+
+    async def aprepare(self, rows):
+        # subclasses with a prepare() that queries should override this with the async ORM
+        if type(self).prepare is not ValuesSerializer.prepare:
+            await sync_to_async(self.prepare)(rows)
+
+    async def aserialize(self, rows):
+        if isinstance(rows, QuerySet):
+            rows = [row async for row in rows.aiterator()]
+        await self.aprepare(rows)
+        with timed('serialize'):
+            return [self.build(row, self.accessors) for row in rows]
+
+    def group(self, queryset, column):
+        '''
+        Serialized rows of the queryset as {row[column]: [item, ...]}, for many=True nested fields.
+        '''
+        rows = list(self.values(queryset, column))
+        grouped = {}
+        for row, item in zip(rows, self.serialize(rows)):
+            grouped.setdefault(row[column], []).append(item)
+        return grouped
+
+
+class CollectionValues(ValuesSerializer):
+    serializer_class = CollectionSerializer
+
+
+class ProductValues(ValuesSerializer):
+    serializer_class = ProductSerializer
+    # so KeysetPagination can seek on any of ProductViewSet.ordering_fields
+    extra_columns = ['last_update']
+
+    def prepare(self, rows):
+        self.tags = TaggedItem.objects.get_tags_for_many(Product, [row['id'] for row in rows])
+
+    async def aprepare(self, rows):
+        self.tags = await TaggedItem.objects.aget_tags_for_many(Product, [row['id'] for row in rows])
+
+    def get_tags(self, row):
+        return [tag.label for tag in self.tags.get(row['id'], [])]
+
+
+class ReviewValues(ValuesSerializer):
+    serializer_class = ReviewSerializer
+
+
+class CartItemValues(ValuesSerializer):
+    serializer_class = CartItemSerializer
+
+
+class CartValues(ValuesSerializer):
+    serializer_class = CartSerializer
+    extra_columns = ['total_price']
+
+    def prepare(self, rows):
+        items = CartItem.objects.with_total_price().filter(cart_id__in=[row['id'] for row in rows])
+        self.items = CartItemValues().group(items, 'cart_id')
+
+    def get_items(self, row):
+        return self.items.get(row['id'], [])
+
+    def get_total_price(self, row):
+        # same as CartSerializer.get_total_price
+        return row['total_price'] or 0
+
+
+class OrderItemValues(ValuesSerializer):
+    serializer_class = OrderItemSerializer
+
+
+class OrderValues(ValuesSerializer):
+    serializer_class = OrderSerializer
+
+    def prepare(self, rows):
+        items = OrderItem.objects.filter(order_id__in=[row['id'] for row in rows])
+        self.items = OrderItemValues().group(items, 'order_id')
+
+    def get_items(self, row):
+        return self.items.get(row['id'], [])
+
+
+class ValuesResponseMixin:
+    '''
+    Answers list and retrieve through values_serializer_class instead of the viewset's ModelSerializer.
+    '''
+    values_serializer_class = None
+
+    def get_values_serializer(self):
+        return self.values_serializer_class(context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        rows = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = serializer.values(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(rows, **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, row)
+        return Response(serializer.serialize([row])[0])
+
+
+class AsyncValuesResponseMixin(ValuesResponseMixin):
+    '''
+    ValuesResponseMixin with coroutine list and retrieve, see store.viewsets.AsyncViewSetMixin.
+    '''
+    async def list(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        rows = serializer.values(await self.afilter_queryset(self.get_queryset()))
+        page = await self.apaginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(await serializer.aserialize(page))
+        return Response(await serializer.aserialize(rows))
+
+    async def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = serializer.values(await self.afilter_queryset(self.get_queryset()))
+        row = await aget_object_or_404(rows, **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        await self.acheck_object_permissions(request, row)
+        return Response((await serializer.aserialize([row]))[0])
@@ -0,0 +1,92 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from .permissions import aget_user, ahas_object_permission, ahas_permission
+
+
+# Under ASGI a sync view holds a worker thread for the whole request, including every query it waits on.
+# AsyncViewSetMixin lets a DRF viewset run on the event loop instead: actions written as coroutines, the catalogue
+# reads, use the async ORM, and the actions left sync, the writes, run in a thread as before.
+
+
+async def aget_object_or_404(queryset, **filter_kwargs):
+    # rest_framework.generics.get_object_or_404() with aget()
+    try:
+        return await queryset.aget(**filter_kwargs)
+    except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+        raise Http404
+
+
+class AsyncViewSetMixin:
+    '''
+    APIView.dispatch() as a coroutine. Authentication stays lazy, so a read that no permission needs the user for
+    never looks the user up. Permissions are awaited through store.permissions.ahas_permission(), filter backends
+    with an afilter_queryset() are awaited and the others are expected not to query.
+    '''
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        # Django runs views marked as coroutine functions on the event loop
+        return markcoroutinefunction(super().as_view(actions, **initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        # APIView.initial() without perform_authentication()
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+        request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+        await self.acheck_permissions(request)
+        if self.get_throttles():
+            await sync_to_async(self.check_throttles)(request)
+
+    async def acheck_permissions(self, request):
+        for permission in self.get_permissions():
+            if not await ahas_permission(permission, request, self):
+                await self.apermission_denied(request, permission)
+
+    async def acheck_object_permissions(self, request, obj):
+        for permission in self.get_permissions():
+            if not await ahas_object_permission(permission, request, self, obj):
+                await self.apermission_denied(request, permission)
+
+    async def apermission_denied(self, request, permission):
+        # permission_denied() answers 401 or 403 depending on whether anyone authenticated
+        await aget_user(request)
+        self.permission_denied(request, getattr(permission, 'message', None), getattr(permission, 'code', None))
+
+    async def afilter_queryset(self, queryset):
+        for backend in list(self.filter_backends):
+            backend = backend()
+            if hasattr(backend, 'afilter_queryset'):
+                queryset = await backend.afilter_queryset(self.request, queryset, self)
+            else:
+                queryset = backend.filter_queryset(self.request, queryset, self)
+        return queryset
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
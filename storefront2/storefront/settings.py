@@ -49,8 +49,9 @@ INSTALLED_APPS = [
     'likes',
 ]
 
-MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+# the debug toolbar middleware is sync only, under ASGI it would hold a thread for every request
+MIDDLEWARE = (['debug_toolbar.middleware.DebugToolbarMiddleware'] if DEBUG else []) + [
+    'store.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +59,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'likes.middleware.LikeBufferMiddleware',
+    'store.middleware.ReplicaRoutingMiddleware',
+    'store.middleware.QueryBudgetMiddleware',
 ]
 
 INTERNAL_IPS = [
@@ -90,16 +94,89 @@ WSGI_APPLICATION = 'storefront.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Connections stay open for CONN_MAX_AGE seconds across requests and are pinged before reuse after an error.
+# Under ASGI every request runs its queries on a thread of its own, so persistent connections would pile up there.
+# Use the pooling engine instead, which shares connections between threads:
+#     'ENGINE': 'store.db.backends.mysql',
+#     'CONN_MAX_AGE': 0,
+#     'POOL': {'SIZE': 10, 'MAX_OVERFLOW': 10, 'TIMEOUT': 30, 'RECYCLE': 3600},
+# store.db.pool.pool_stats() reports how long requests waited for a connection.
+# storefront/settings_local.py runs the project on SQLite through the same pool.
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.mysql',
         'NAME': 'storefront2',
         'HOST': 'localhost',
         'USER': 'root',
-        'PASSWORD': 'N00bfighter101@'
+        'PASSWORD': 'N00bfighter101@',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Aliases in DATABASES that replicate 'default'. GET requests read products, collections, reviews and tags from them,
+# see store.routers. A client that wrote reads from the primary for STORE_REPLICA_PIN_SECONDS to see its own writes,
+# and replicas more than STORE_REPLICA_MAX_LAG seconds behind are skipped until they catch up.
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+STORE_READ_REPLICAS = []
+STORE_REPLICA_PIN_SECONDS = 10
+STORE_REPLICA_MAX_LAG = 5
+STORE_REPLICA_LAG_CHECK_SECONDS = 5
+
+
+# Cache used by the store catalogue endpoints (store.cache).
+# Swap in 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION directory to share it between processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'storefront',
+    }
+}
+
+STORE_CACHE_ALIAS = 'default'
+STORE_CACHE_TIMEOUT = 300
+
+# Product.price_with_tax is stored, run ./manage.py refresh_prices after changing the rate.
+# A string so the rate is an exact Decimal
+STORE_TAX_RATE = '0.10'
+
+# Serve the catalogue reads (products, collections, reviews) from the async viewsets in store.views.
+# Worth it when running under storefront.asgi, under WSGI every async request starts its own event loop.
+# ./manage.py load_test compares the two.
+STORE_ASYNC_VIEWS = False
+
+# How long POST /store/carts/<id>/reserve/ holds stock, expired reservations are returned by
+# ./manage.py release_expired_reservations
+STORE_RESERVATION_MINUTES = 15
+
+# Adding a product that is already in a cart sums the quantities, capped at this. At most 32767, the column's limit
+STORE_MAX_CART_QUANTITY = 32767
+
+# store.middleware.QueryBudgetMiddleware checks the views in these modules against their query_budget and flags
+# query shapes repeated this many times. Violations are logged, the test runner makes them fail the test instead.
+STORE_QUERY_BUDGET_MODULES = ['store.views']
+STORE_QUERY_REPEAT_THRESHOLD = 3
+STORE_QUERY_BUDGET_STRICT = False
+# a file to capture every query of those views into, for ./manage.py advise_indexes
+STORE_QUERY_LOG = None
+
+# store.middleware.MetricsMiddleware keeps latency histograms per route, served to staff at /store/metrics/ in the
+# Prometheus text format. Routes listed here, e.g. {'products': 0.01}, run that fraction of their requests under
+# cProfile and write the stats into STORE_PROFILE_DIR, for python -m pstats or snakeviz.
+STORE_PROFILE_ROUTES = {}
+STORE_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# worker processes hashing the passwords of store.provisioning bulk sign-ups, None for one per CPU
+STORE_PASSWORD_HASHING_PROCESSES = None
+
+TEST_RUNNER = 'store.testing.QueryBudgetTestRunner'
+
+# likes.buffer writes pending likes once this many are waiting or the oldest is this many seconds old
+LIKES_BUFFER_SIZE = 500
+LIKES_BUFFER_SECONDS = 5.0
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -148,7 +225,15 @@ REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # orjson when it is installed, see store.renderers. The browsable API is only for development
+    'DEFAULT_RENDERER_CLASSES': ['store.renderers.FastJSONRenderer'] +
+                                (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'store.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
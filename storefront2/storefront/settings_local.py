@@ -0,0 +1,31 @@
+"""
+Runs the project against local SQLite files instead of the MySQL servers, a primary and a read replica, through
+the connection pool engine, so everything including the pool and the replica routing can be tried without external
+services:
+
+    python manage.py migrate --settings=storefront.settings_local
+    python manage.py migrate --database=replica --settings=storefront.settings_local
+    python manage.py test --settings=storefront.settings_local
+"""
+
+from .settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'store.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'local.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {'SIZE': 5, 'MAX_OVERFLOW': 5, 'TIMEOUT': 10},
+    },
+    # stands in for a read replica. Nothing copies the primary into it, copy local.sqlite3 over it to catch it up
+    'replica': {
+        'ENGINE': 'store.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'local_replica.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {'SIZE': 5, 'MAX_OVERFLOW': 5, 'TIMEOUT': 10},
+    },
+}
+
+STORE_READ_REPLICAS = ['replica']
@@ -3,16 +3,67 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 
+def content_type_lookups(obj_type):
+    # the content type by its app label and model, ContentType.objects.get_for_model()'s first call per model is a
+    # query of its own
+    opts = obj_type._meta.concrete_model._meta
+    return {'content_type__app_label': opts.app_label, 'content_type__model': opts.model_name}
+
+
 class TaggedItemManager(models.Manager):
     def get_tags_for(self, obj_type, obj_id):
+        return TaggedItem.objects \
+            .select_related('tag') \
+            .filter(
+                object_id=obj_id,
+                **content_type_lookups(obj_type)
+            )
+
+    def get_tags_for_many(self, obj_type, obj_ids):
+        '''
+        Tags of many objects of one type in a single query, as {object_id: [tag, ...]}.
+        obj_ids can be a list of ids or a queryset of obj_type.
+        '''
         content_type = ContentType.objects.get_for_model(obj_type)
+        if isinstance(obj_ids, models.QuerySet):
+            obj_ids = obj_ids.values('pk')
 
-        return TaggedItem.objects \
+        tags = {}
+        tagged_items = TaggedItem.objects \
             .select_related('tag') \
             .filter(
                 content_type=content_type,
-                object_id=obj_id
+                object_id__in=obj_ids
             )
+        for tagged_item in tagged_items:
+            tags.setdefault(tagged_item.object_id, []).append(tagged_item.tag)
+        return tags
+
+    async def aget_tags_for_many(self, obj_type, obj_ids):
+        '''
+        get_tags_for_many() for async code, which can't call the synchronous ContentType.objects.get_for_model().
+        '''
+        tags = {}
+        tagged_items = TaggedItem.objects \
+            .select_related('tag') \
+            .filter(
+                object_id__in=obj_ids,
+                **content_type_lookups(obj_type)
+            )
+        async for tagged_item in tagged_items.aiterator():
+            tags.setdefault(tagged_item.object_id, []).append(tagged_item.tag)
+        return tags
+
+    def prefetch_tags(self, objects):
+        '''
+        Sets prefetched_tags on every object so tags.serializers.TagsField doesn't query per object.
+        '''
+        objects = list(objects)
+        if objects:
+            tags = self.get_tags_for_many(type(objects[0]), [obj.pk for obj in objects])
+            for obj in objects:
+                obj.prefetched_tags = tags.get(obj.pk, [])
+        return objects
 
 
 class Tag(models.Model):
@@ -28,3 +79,8 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'])
+        ]
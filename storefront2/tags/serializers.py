@@ -0,0 +1,27 @@
+from django.db import models
+from rest_framework import serializers
+from .models import TaggedItem
+
+
+class TagsField(serializers.Field):
+    '''
+    Read-only list of the object's tag labels. Uses the tags set by TaggedItem.objects.prefetch_tags()
+    and falls back to one query for a single object.
+    '''
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        tags = getattr(obj, 'prefetched_tags', None)
+        if tags is None:
+            tags = [tagged_item.tag for tagged_item in TaggedItem.objects.get_tags_for(type(obj), obj.pk)]
+        return [tag.label for tag in tags]
+
+
+class TaggedListSerializer(serializers.ListSerializer):
+    # list_serializer_class for serializers with a TagsField, loads the tags of the whole page in one query
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return super().to_representation(TaggedItem.objects.prefetch_tags(iterable))
@@ -1,3 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
+from rest_framework import serializers
+from .models import Tag, TaggedItem
+from .serializers import TaggedListSerializer, TagsField
 
-# Create your tests here.
+
+class TaggedSerializer(serializers.Serializer):
+    tags = TagsField()
+
+    class Meta:
+        list_serializer_class = TaggedListSerializer
+
+
+class TagsTest(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        # anything can be tagged, users will do
+        self.users = [User.objects.create_user(username=f'user{index}', email=f'user{index}@example.com')
+                      for index in range(3)]
+        self.tags = [Tag.objects.create(label=label) for label in ('new', 'sale')]
+        content_type = ContentType.objects.get_for_model(User)
+        for user, tag in [(self.users[0], self.tags[0]), (self.users[0], self.tags[1]), (self.users[1], self.tags[1])]:
+            TaggedItem.objects.create(tag=tag, content_type=content_type, object_id=user.pk)
+        # the lookups shouldn't need the content type cache
+        ContentType.objects.clear_cache()
+
+    def labels(self, tags):
+        return {pk: sorted(tag.label for tag in object_tags) for pk, object_tags in tags.items()}
+
+    def test_get_tags_for(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(item.tag.label for item in TaggedItem.objects.get_tags_for(
+                get_user_model(), self.users[0].pk)), ['new', 'sale'])
+
+    def test_get_tags_for_many(self):
+        first, second, untagged = self.users
+        expected = {first.pk: ['new', 'sale'], second.pk: ['sale']}
+        ContentType.objects.get_for_model(get_user_model())
+        with self.assertNumQueries(1):
+            tags = TaggedItem.objects.get_tags_for_many(get_user_model(), [user.pk for user in self.users])
+        self.assertEqual(self.labels(tags), expected)
+        self.assertEqual(self.labels(TaggedItem.objects.get_tags_for_many(
+            get_user_model(), get_user_model().objects.all())), expected)
+
+    async def test_aget_tags_for_many(self):
+        tags = await TaggedItem.objects.aget_tags_for_many(get_user_model(), [user.pk for user in self.users])
+        self.assertEqual(self.labels(tags), {self.users[0].pk: ['new', 'sale'], self.users[1].pk: ['sale']})
+
+    def test_prefetch_tags(self):
+        ContentType.objects.get_for_model(get_user_model())
+        with self.assertNumQueries(1):
+            users = TaggedItem.objects.prefetch_tags(self.users)
+        self.assertEqual([sorted(tag.label for tag in user.prefetched_tags) for user in users],
+                         [['new', 'sale'], ['sale'], []])
+        self.assertEqual(TaggedItem.objects.prefetch_tags([]), [])
+
+    def test_tags_field(self):
+        self.assertEqual(sorted(TaggedSerializer(self.users[0]).data['tags']), ['new', 'sale'])
+        ContentType.objects.get_for_model(get_user_model())
+        with self.assertNumQueries(2):
+            # the users and their tags
+            data = TaggedSerializer(get_user_model().objects.order_by('pk'), many=True).data
+        self.assertEqual([sorted(row['tags']) for row in data], [['new', 'sale'], ['sale'], []])